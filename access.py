@@ -0,0 +1,67 @@
+"""Кто может пользоваться ботом.
+
+Разрешенные пользователи задаются в conf.py: ALLOWED_USER_IDS (id в
+Telegram) и ALLOWED_USERNAMES. Проверка идет по sender_id из апдейта без
+запросов к Telegram. Имя пользователя сверяется с сущностью, которая
+приходит вместе с апдейтом, и ответ запоминается по id, так что get_sender
+вызывается не больше раза на нового отправителя, и то только если сущности
+в апдейте не было. conf.py перечитывается, когда меняется время его
+изменения, поэтому список можно править, не перезапуская бота.
+"""
+import importlib
+import os
+
+
+class Allowlist:
+    """Список доступа из модуля настроек с перечитыванием на лету"""
+
+    def __init__(self, settings, default_usernames=()):
+        self.settings = settings
+        self.default_usernames = default_usernames
+        self.ids = frozenset()
+        self.usernames = frozenset()
+        self._known = {}  # sender_id -> разрешен ли, для проверенных по имени
+        self._loaded = False
+        self._mtime = None
+        self.refresh()
+
+    def _conf_mtime(self):
+        path = getattr(self.settings, '__file__', None)
+        try:
+            return os.path.getmtime(path) if path else None
+        except OSError:
+            return self._mtime
+
+    def refresh(self):
+        """Перечитывает настройки, если conf.py поменялся"""
+        mtime = self._conf_mtime()
+        if self._loaded and mtime == self._mtime:
+            return
+        self._mtime = mtime
+        if self._loaded:
+            try:
+                importlib.reload(self.settings)
+            except Exception as e:
+                print(f"conf.py не перечитан, остается прежний список доступа: {e}")
+                return
+            print("conf.py изменился, список доступа перечитан")
+        self._loaded = True
+        self.ids = frozenset(getattr(self.settings, 'ALLOWED_USER_IDS', ()))
+        usernames = getattr(self.settings, 'ALLOWED_USERNAMES', self.default_usernames)
+        self.usernames = frozenset(name.lstrip('@').lower() for name in usernames)
+        self._known.clear()
+
+    async def allows(self, event):
+        """Можно ли обслужить отправителя апдейта (сообщения или нажатия кнопки)"""
+        self.refresh()
+        sender_id = event.sender_id
+        if sender_id in self.ids:
+            return True
+        if sender_id is None or not self.usernames:
+            return False
+        allowed = self._known.get(sender_id)
+        if allowed is None:
+            sender = event.sender or await event.get_sender()
+            username = (getattr(sender, 'username', None) or '').lower()
+            allowed = self._known[sender_id] = username in self.usernames
+        return allowed
@@ -0,0 +1,111 @@
+"""Бэкенды инференса: обычный whisper, int8-квантованный whisper и faster-whisper.
+
+Модель выбирается ключом "имя" или "имя:бэкенд", например "small:int8".
+У всех бэкендов одинаковый transcribe_iter, отдающий события engine.
+torch и whisper импортируются при первой загрузке модели, а не при импорте модуля.
+"""
+import importlib.util
+
+from transcript import Progress, Segment, Transcript
+
+DEFAULT_BACKEND = 'fp32'
+
+
+class WhisperBackend:
+    """Стоковый whisper в fp32"""
+    key = 'fp32'
+    title = 'fp32'
+
+    def available(self):
+        return True
+
+    def load(self, name):
+        import whisper
+        return whisper.load_model(name, device='cpu')
+
+    def transcribe_iter(self, model, audio, language=None):
+        import engine
+        return engine.transcribe_iter(model, audio, language)
+
+
+def _plain_linears(module):
+    """Меняет whisper.model.Linear на обычные nn.Linear: quantize_dynamic
+    узнает слои по точному типу и подклассы пропускает"""
+    import torch
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            plain = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            plain.load_state_dict(child.state_dict())
+            setattr(module, name, plain)
+        else:
+            _plain_linears(child)
+    return module
+
+
+class QuantizedBackend(WhisperBackend):
+    """whisper с динамической int8-квантизацией линейных слоев.
+
+    Веса линейных слоев (почти вся модель) хранятся в int8, активации
+    квантуются на лету. Модель занимает примерно в 3 раза меньше памяти
+    и на CPU считается в 2-3 раза быстрее при почти том же качестве.
+    """
+    key = 'int8'
+    title = 'int8'
+
+    def load(self, name):
+        import torch
+        model = _plain_linears(super().load(name).eval())
+        # inplace: иначе quantize_dynamic сначала копирует всю fp32-модель,
+        # и пик памяти при загрузке вдвое больше fp32, а не меньше
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class FasterWhisperBackend:
+    """CTranslate2 через faster-whisper (необязательная зависимость)"""
+    key = 'ct2'
+    title = 'ct2 int8'
+
+    def available(self):
+        return importlib.util.find_spec('faster_whisper') is not None
+
+    def load(self, name):
+        import torch
+        from faster_whisper import WhisperModel
+        return WhisperModel(name, device='cpu', compute_type='int8', cpu_threads=torch.get_num_threads())
+
+    def transcribe_iter(self, model, audio, language=None):
+        segments, info = model.transcribe(audio, language=language, beam_size=1)
+        result = []
+        for s in segments:
+            segment = Segment(s.start, s.end, s.text)
+            result.append(segment)
+            yield segment
+            yield Progress(min(s.end, info.duration), info.duration)
+        return Transcript(result, info.language)
+
+
+BACKENDS = {backend.key: backend for backend in (WhisperBackend(), QuantizedBackend(), FasterWhisperBackend())}
+
+
+def parse_model_key(key):
+    """small:int8 -> ("small", бэкенд int8), без суффикса — fp32"""
+    name, _, backend = key.partition(':')
+    return name, BACKENDS[backend or DEFAULT_BACKEND]
+
+
+def model_key(name, backend):
+    return name if backend == DEFAULT_BACKEND else f"{name}:{backend}"
+
+
+def available_backends():
+    return [backend for backend in BACKENDS.values() if backend.available()]
+
+
+def load_model(key):
+    name, backend = parse_model_key(key)
+    return backend.load(name)
+
+
+def transcribe_iter(key, model, audio, language=None):
+    _, backend = parse_model_key(key)
+    return backend.transcribe_iter(model, audio, language)
@@ -0,0 +1,134 @@
+"""Пакетное распознавание коротких записей.
+
+Короткие голосовые (до 30 секунд) целиком помещаются в одно окно whisper,
+и каждое отдельное распознавание почти все время тратит на накладные расходы
+маленьких матричных умножений. Батчер собирает записи, пришедшие почти
+одновременно из разных потоков инференса, складывает их мел-спектрограммы
+в один батч и прогоняет энкодер и декодер один раз на всех. Результаты
+раздаются обратно ждущим потокам.
+
+Первый поток, пришедший с записью, становится ведущим: ждет окно сбора,
+забирает все накопившиеся записи той же модели и распознает их на одной
+реплике. Остальные просто ждут свой результат.
+"""
+import threading
+import time
+
+from ingest import SAMPLE_RATE
+from transcript import Progress, Transcript
+
+MAX_CLIP_SECONDS = 30  # одно окно whisper
+
+
+def fits(audio):
+    """Запись целиком помещается в одно окно и может идти в батч"""
+    return not hasattr(audio, 'wait') and 0 < len(audio) <= MAX_CLIP_SECONDS * SAMPLE_RATE
+
+
+def decode_batch(model, clips, language=None):
+    """Распознает несколько коротких записей одним вызовом model.decode.
+
+    Язык определяется для каждой записи отдельно, если не задан. Записи,
+    которым нужен фолбэк по температуре или которые модель не дописала
+    до конца окна, перераспознаются по одной обычным путем.
+    """
+    import torch
+    from whisper.audio import HOP_LENGTH
+    from whisper.decoding import DecodingOptions
+    from whisper.tokenizer import get_tokenizer
+
+    import engine
+    from engine import is_silence, mel_window, needs_fallback, split_segments
+
+    with torch.inference_mode():
+        frames = [len(audio) // HOP_LENGTH for audio in clips]
+        mel = torch.stack([mel_window(model, audio, 0, n) for audio, n in zip(clips, frames)])
+        results = model.decode(mel, DecodingOptions(language=language, temperature=0.0, fp16=False))
+
+    transcripts = []
+    for audio, n, result in zip(clips, frames, results):
+        if is_silence(result):
+            transcripts.append(Transcript([], result.language))
+            continue
+        if not needs_fallback(result):
+            tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                      language=result.language, task='transcribe')
+            segments, consumed = split_segments(result.tokens, tokenizer, 0.0, n)
+            if consumed >= n:
+                segments = [s for s in segments if s.start != s.end and s.text.strip()]
+                transcripts.append(Transcript(segments, result.language))
+                continue
+        transcripts.append(engine.transcribe(model, audio, language))
+    return transcripts
+
+
+class _Request:
+    def __init__(self, audio):
+        self.audio = audio
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ClipBatcher:
+    """Собирает короткие записи в батчи, см. описание модуля.
+
+    registry — ModelRegistry, откуда берется реплика модели на время батча.
+    window — сколько секунд ведущий ждет попутчиков, max_batch — предел батча.
+    """
+
+    def __init__(self, registry, window=0.15, max_batch=8):
+        self.registry = registry
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # (модель, язык) -> записи, ждущие батча
+        self._cond = threading.Condition()
+        self.batches = 0
+        self.clips = 0
+
+    def transcribe(self, model_name, audio, language=None):
+        """Блокирующая транскрипция одной короткой записи в составе батча"""
+        request = _Request(audio)
+        key = (model_name, language)
+        with self._cond:
+            batch = self._pending.setdefault(key, [])
+            batch.append(request)
+            leader = len(batch) == 1
+            if len(batch) >= self.max_batch:
+                self._cond.notify_all()
+                del self._pending[key]
+            elif leader:
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch and (left := deadline - time.monotonic()) > 0:
+                    self._cond.wait(left)
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+        if leader:
+            self._run(model_name, language, batch)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self, model_name, language, batch):
+        try:
+            with self.registry.use(model_name) as model:
+                results = decode_batch(model, [r.audio for r in batch], language)
+            for request, result in zip(batch, results):
+                request.result = result
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            self.batches += 1
+            self.clips += len(batch)
+            for request in batch:
+                request.done.set()
+
+    def transcribe_iter(self, model_name, audio, language=None):
+        """Тот же интерфейс событий, что у engine.transcribe_iter"""
+        total = len(audio) / SAMPLE_RATE
+        transcript = self.transcribe(model_name, audio, language)
+        yield from transcript.segments
+        yield Progress(total, total)
+        return transcript
@@ -0,0 +1,398 @@
+"""Бенчмарк конвейера бота на CPU.
+
+Генерирует записи нужной длины (речь через espeak-ng, если он установлен,
+иначе синтетические «слоги»), прогоняет их по этапам бота и пишет JSON,
+который можно сравнивать между коммитами:
+
+- ingest: декодирование ogg/opus в PCM через ffmpeg;
+- vad: поиск речи;
+- inference: распознавание каждой моделью (ключи как в /model, например tiny:int8);
+- format: сборка результата в каждом формате (txt, srt, vtt, json);
+- concurrency: N одновременных задач на одной модели, пропускная способность;
+- e2e: весь путь голосового от апдейта с фейковым Telegram: роутер,
+  обработчик, очередь, скачивание кусками, распознавание и отправка.
+
+Для каждого этапа — время, RTF (время / длительность аудио), текущий RSS и
+пиковый RSS. Каждая модель, конкурентность и e2e меряются в отдельном
+процессе, так что пик одной модели не попадает в строки другой.
+
+    python bench.py --lengths 10 30 120 --models tiny tiny:int8 --concurrency 1 4 --e2e 4 -o bench.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from formats import FORMATS, Document
+from ingest import SAMPLE_RATE, load_audio
+
+PHRASE = ("Привет, это тестовое сообщение для проверки скорости распознавания. "
+          "Сегодня хорошая погода, и мы обсуждаем планы на следующую неделю.")
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса с начала работы (на Linux ru_maxrss в КБ)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb():
+    """Текущий RSS процесса"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        return None
+
+
+def isolated(fn, *args):
+    """Выполняет fn в отдельном свежем процессе и возвращает ее строки результатов"""
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def synth_syllables(seconds, seed=0):
+    """Похожий на речь сигнал: гармонические «слоги» с паузами между «фразами»"""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SAMPLE_RATE)
+    audio = np.zeros(total, dtype=np.float32)
+    position = 0
+    while position < total:
+        for _ in range(rng.integers(4, 12)):
+            if position >= total:
+                break
+            n = min(int(rng.uniform(0.15, 0.3) * SAMPLE_RATE), total - position)
+            t = np.arange(n) / SAMPLE_RATE
+            f0 = rng.uniform(110, 220)
+            tone = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+            chunk = (0.2 * tone * np.hanning(n)).astype(np.float32)
+            audio[position:position + n] = chunk
+            position += n + int(0.03 * SAMPLE_RATE)
+        position += int(rng.uniform(0.4, 1.2) * SAMPLE_RATE)
+    audio += rng.normal(0, 0.003, total).astype(np.float32)
+    return audio
+
+
+def synth_speech(seconds, workdir):
+    """Речь через espeak-ng, повторенная до нужной длины, или синтетика без него"""
+    tts = shutil.which('espeak-ng') or shutil.which('espeak')
+    if tts is None:
+        return synth_syllables(seconds), 'syllables'
+    path = os.path.join(workdir, 'phrase.wav')
+    subprocess.run([tts, '-v', 'ru', '-w', path, PHRASE], check=True, capture_output=True)
+    unit = np.concatenate([load_audio(path), np.zeros(int(0.7 * SAMPLE_RATE), dtype=np.float32)])
+    reps = -(-int(seconds * SAMPLE_RATE) // len(unit))
+    return np.tile(unit, reps)[:int(seconds * SAMPLE_RATE)], 'espeak'
+
+
+def write_clip(audio, path):
+    """Сохраняет PCM так же, как приходят голосовые: ogg/opus 32 кбит/с"""
+    subprocess.run([
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-f', 'f32le', '-ar', str(SAMPLE_RATE), '-ac', '1', '-i', 'pipe:0',
+        '-c:a', 'libopus', '-b:a', '32k', '-y', path,
+    ], input=audio.tobytes(), check=True)
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def record(results, stage, seconds, wall, **extra):
+    rss = rss_mb()
+    row = {'stage': stage, 'audio_seconds': round(seconds, 2), 'wall': round(wall, 4),
+           'rtf': round(wall / seconds, 4) if seconds else None, 'rss_mb': rss and round(rss, 1),
+           'peak_rss_mb': round(peak_rss_mb(), 1), **extra}
+    results.append(row)
+    details = ", ".join(f"{k}={v}" for k, v in extra.items())
+    print(f"{stage:12} {seconds:7.1f} с аудио  {wall:8.3f} с  RTF {row['rtf'] or 0:.3f}  "
+          f"RSS {rss or 0:.0f} МБ (пик {row['peak_rss_mb']:.0f})  {details}")
+
+
+def drain(events):
+    while True:
+        try:
+            next(events)
+        except StopIteration as e:
+            return e.value
+
+
+def build_document(fmt, transcript):
+    """Сборка результата так же, как при отправке, только в памяти"""
+    document = Document(fmt, 'bench')
+    for segment in transcript.segments:
+        document.add(segment)
+    document.close(transcript.language)
+    return document
+
+
+def bench_model(key, clips):
+    """Все этапы на одной модели, выполняется в отдельном процессе"""
+    from backends import load_model, transcribe_iter
+    from vad import apply_vad
+
+    results = []
+    model, load = timed(load_model, key)
+    print(f"{key}: загрузка {load:.1f} с")
+    results.append({'stage': 'load', 'model': key, 'wall': round(load, 3),
+                    'rss_mb': rss_mb(), 'peak_rss_mb': round(peak_rss_mb(), 1)})
+    for seconds, path in clips:
+        audio, wall = timed(load_audio, path)
+        record(results, 'ingest', seconds, wall, model=key)
+        _, wall = timed(apply_vad, audio)
+        record(results, 'vad', seconds, wall, model=key)
+        transcript, wall = timed(drain, transcribe_iter(key, model, audio))
+        record(results, 'inference', seconds, wall, model=key, chars=len(transcript.text))
+        for fmt in FORMATS:
+            document, wall = timed(build_document, fmt, transcript)
+            record(results, 'format', seconds, wall, model=key, format=fmt, chars=document.chars)
+    return results
+
+
+def bench_concurrency(clip, key, levels):
+    """N одновременных распознаваний одной записи, как при N воркерах бота"""
+    import torch
+
+    from backends import load_model, transcribe_iter
+    from inference import init_executor, iterate_in_executor
+    from registry import ModelRegistry
+
+    results = []
+    seconds, path = clip
+    audio = load_audio(path)
+    registry = ModelRegistry(load_model)
+
+    def run(model_key):
+        with registry.use(model_key) as model:
+            return (yield from transcribe_iter(model_key, model, audio))
+
+    async def job():
+        async for _ in iterate_in_executor(run, key):
+            pass
+
+    async def measure(n):
+        started = time.perf_counter()
+        await asyncio.gather(*(job() for _ in range(n)))
+        return time.perf_counter() - started
+
+    for n in levels:
+        init_executor(n)
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // n))
+        # реплики загружаем заранее, чтобы не мерить загрузку
+        replicas = [registry.acquire(key) for _ in range(n)]
+        for model in replicas:
+            registry.release(key, model)
+        wall = asyncio.run(measure(n))
+        record(results, 'concurrency', seconds * n, wall, model=key, jobs=n,
+               throughput=round(seconds * n / wall, 2))
+    return results
+
+
+BENCH_USERNAME = 'bench'
+
+
+class FakeMessage:
+    def __init__(self, message_id, chat_id, text, media=None, file=None):
+        self.id = message_id
+        self.chat_id = chat_id
+        self.text = text
+        self.media = media
+        self.file = file
+        self.voice = media is not None
+
+
+class FakeEvent:
+    """NewMessage-апдейт: сущность отправителя пришла вместе с ним, как обычно у ботов"""
+
+    def __init__(self, message, sender_id):
+        self.message = message
+        self.chat_id = message.chat_id
+        self.sender_id = sender_id
+        self.sender = types.SimpleNamespace(id=sender_id, username=BENCH_USERNAME)
+
+    async def get_sender(self):
+        return self.sender
+
+    async def respond(self, text, **kwargs):
+        pass
+
+
+class FakeTelegram:
+    """Заменяет TelegramClient: отдает файлы кусками, запоминает отправленное,
+    ничего не шлет в сеть"""
+
+    def __init__(self):
+        self.messages = []
+        self.incoming = {}  # message_id -> FakeMessage, для get_messages
+        self.edits = 0
+        self.deleted = 0
+        self.results = {}  # chat_id -> когда пришел результат
+
+    async def send_message(self, chat_id, text, **kwargs):
+        message = FakeMessage(len(self.messages) + 1, chat_id, text)
+        self.messages.append(message)
+        if text.startswith('#result'):
+            self.results[chat_id] = time.time()
+        return message
+
+    async def edit_message(self, chat_id, message_id, text, **kwargs):
+        self.edits += 1
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        self.deleted += 1
+
+    async def send_file(self, chat_id, file, caption='', **kwargs):
+        return await self.send_message(chat_id, caption)
+
+    async def get_messages(self, chat_id, ids=None):
+        return self.incoming.get(ids)
+
+    async def iter_download(self, media, offset=0, limit=None, request_size=512 * 1024, file_size=None):
+        with open(media.path, 'rb') as f:
+            f.seek(offset)
+            for _ in range(limit if limit is not None else 1 << 30):
+                data = f.read(request_size)
+                if not data:
+                    return
+                yield data
+
+    async def download_media(self, message, path):
+        shutil.copyfile(message.media.path, path)
+        return path
+
+
+def voice_update(bot, path, seconds, n):
+    """Голосовое из чата n, как его присылает Telegram"""
+    from telethon.tl.types import DocumentAttributeAudio
+
+    size = os.path.getsize(path)
+    document = types.SimpleNamespace(id=n, size=size, mime_type='audio/ogg',
+                                      attributes=[DocumentAttributeAudio(duration=int(seconds), voice=True)])
+    media = types.SimpleNamespace(document=document, path=path)
+    file = types.SimpleNamespace(size=size, duration=int(seconds), name=None)
+    message = FakeMessage(1000 + n, n, '', media, file)
+    bot.incoming[message.id] = message
+    return FakeEvent(message, n)
+
+
+def bench_end_to_end(clip, key, jobs, workdir):
+    """Голосовые проходят роутер, обработчик, очередь, скачивание и распознавание"""
+    if importlib.util.find_spec('conf') is None:
+        # main ждет conf.py с токенами, для бенчмарка они не нужны
+        conf = types.ModuleType('conf')
+        conf.BOT_TOKEN, conf.API_ID, conf.API_HASH = '', 0, ''
+        sys.modules['conf'] = conf
+    import main
+    from access import Allowlist
+    from cache import ResultCache
+    from inference import init_executor
+    from journal import JobJournal
+    from workspace import Workspaces
+
+    # все, что main.setup() открывает на диске, — во временной папке бенчмарка
+    fake = main.bot = FakeTelegram()
+    # все задачи везут одну и ту же запись: кэш нулевого размера сразу все вытесняет,
+    # чтобы следующие задачи не отвечали из кэша без распознавания
+    main.RESULTS = ResultCache(os.path.join(workdir, f'results-{key}.sqlite'), max_mb=0)
+    main.JOURNAL = JobJournal(os.path.join(workdir, f'journal-{key}.sqlite'))
+    main.WORKSPACES = Workspaces(workdir)
+    main.ACCESS = Allowlist(types.SimpleNamespace(ALLOWED_USERNAMES=[BENCH_USERNAME]))
+    main.conf.current_model = key
+    init_executor(main.WORKERS)
+
+    seconds, path = clip
+    results = []
+
+    async def run():
+        main.scheduler.start()
+        sent = {}
+        started = time.perf_counter()
+        for n in range(1, jobs + 1):
+            sent[n] = time.time()
+            await main.message_router(voice_update(fake, path, seconds, n))
+        while main.scheduler.pending() or main.scheduler.running():
+            await asyncio.sleep(0.05)
+        wall = time.perf_counter() - started
+        await main.scheduler.stop()
+        return wall, [fake.results[n] - sent[n] for n in sent if n in fake.results]
+
+    wall, latencies = asyncio.run(run())
+    errors = sum(1 for m in fake.messages if m.text.startswith('❌'))
+    record(results, 'e2e', seconds * jobs, wall, model=key, jobs=jobs,
+           workers=main.WORKERS, throughput=round(seconds * jobs / wall, 2),
+           latency_max=round(max(latencies, default=0), 2), done=len(latencies),
+           messages=len(fake.messages), edits=fake.edits, errors=errors)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lengths', type=float, nargs='+', default=[10, 30, 120])
+    parser.add_argument('--models', nargs='+', default=['tiny'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--e2e', type=int, default=0, metavar='JOBS',
+                        help='сколько задач прогнать через обработчик бота (0 — не гонять)')
+    parser.add_argument('--clips', nargs='*', default=[], help='свои записи вместо сгенерированных')
+    parser.add_argument('-o', '--output', default='bench.json')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        clips = []
+        source = 'files'
+        for path in args.clips:
+            clips.append((len(load_audio(path)) / SAMPLE_RATE, path))
+        for seconds in args.lengths if not args.clips else []:
+            audio, source = synth_speech(seconds, workdir)
+            path = os.path.join(workdir, f"clip-{seconds:g}.ogg")
+            write_clip(audio, path)
+            clips.append((seconds, path))
+
+        for key in args.models:
+            results.extend(isolated(bench_model, key, clips))
+        # конкурентность и e2e меряем на самой короткой записи — типичное голосовое
+        shortest = min(clips)
+        for key in args.models:
+            results.extend(isolated(bench_concurrency, shortest, key, args.concurrency))
+        if args.e2e:
+            for key in args.models:
+                results.extend(isolated(bench_end_to_end, shortest, key, args.e2e, workdir))
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpus': os.cpu_count(), 'platform': platform.platform()},
+        'clips': source,
+        'args': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Кэш готовых транскрипций на диске (SQLite).
+
+Результат ищется по id документа телеграма (пересланные голосовые и
+повторно отправленные файлы сохраняют его) или по sha256 содержимого,
+вместе с моделью, языком и тем, вырезалась ли тишина (VAD). Попадание по id документа позволяет не
+скачивать файл вовсе, по хэшу — не запускать инференс.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    doc_id INTEGER,
+    sha256 TEXT NOT NULL,
+    model TEXT NOT NULL,
+    language TEXT NOT NULL,
+    vad INTEGER NOT NULL DEFAULT 0,
+    text TEXT NOT NULL,
+    segments TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS results_doc_vad ON results (doc_id, model, language, vad);
+CREATE UNIQUE INDEX IF NOT EXISTS results_hash_vad ON results (sha256, model, language, vad);
+"""
+
+
+def file_sha256(path):
+    """sha256 файла, читается блоками по мегабайту"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CachedResult:
+    def __init__(self, text, segments, language):
+        self.text = text
+        self.segments = segments  # список (start, end, text)
+        self.language = language
+
+
+class ResultCache:
+    """Кэш транскрипций с вытеснением давно не использованных записей по размеру"""
+
+    def __init__(self, path, max_mb=200):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._migrate()
+        self._db.executescript(INDEXES)
+
+    def _migrate(self):
+        """Кэш старой версии, без колонки vad: все его записи сделаны без VAD"""
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(results)")]
+        if 'vad' not in columns:
+            self._db.executescript("""
+                ALTER TABLE results ADD COLUMN vad INTEGER NOT NULL DEFAULT 0;
+                DROP INDEX IF EXISTS results_doc;
+                DROP INDEX IF EXISTS results_hash;
+            """)
+
+    def _fetch(self, where, args):
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT id, text, segments, language FROM results WHERE {where} "
+                f"ORDER BY used DESC LIMIT 1", args).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE results SET used = ? WHERE id = ?", (time.time(), row[0]))
+            self._db.commit()
+        self.hits += 1
+        return CachedResult(row[1], [tuple(s) for s in json.loads(row[2])], row[3])
+
+    def get_by_document(self, doc_id, model, vad=False, language='auto'):
+        if doc_id is None:
+            return None
+        return self._fetch("doc_id = ? AND model = ? AND language = ? AND vad = ?",
+                           (doc_id, model, language, int(vad)))
+
+    def get_by_hash(self, sha256, model, vad=False, language='auto'):
+        return self._fetch("sha256 = ? AND model = ? AND language = ? AND vad = ?",
+                           (sha256, model, language, int(vad)))
+
+    def put(self, sha256, model, text, segments, doc_id=None, vad=False, language='auto'):
+        """Сохраняет результат; segments — последовательность (start, end, text),
+        vad — распознавалась ли запись с вырезанной тишиной"""
+        segments_json = json.dumps([list(s) for s in segments], ensure_ascii=False)
+        size = len(text.encode('utf-8')) + len(segments_json.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results "
+                "(doc_id, sha256, model, language, vad, text, segments, size, created, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc_id, sha256, model, language, int(vad), text, segments_json, size, now, now))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for row_id, size in self._db.execute("SELECT id, size FROM results ORDER BY used").fetchall():
+            self._db.execute("DELETE FROM results WHERE id = ?", (row_id,))
+            total -= size
+            if total <= self.max_bytes:
+                break
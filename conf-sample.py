@@ -1,4 +1,29 @@
 BOT_TOKEN=r'ваш токен для бота'
 API_HASH = 'апи_хэш'
 API_ID = апи_ид  # инт
-# смотрите доку по телетону.
\ No newline at end of file
+# смотрите доку по телетону.
+
+# необязательные настройки
+# ALLOWED_USER_IDS = [123456789]  # id пользователей, которым можно пользоваться ботом (правки подхватываются без перезапуска)
+# ALLOWED_USERNAMES = ['ressiwage']  # то же по имени пользователя
+# WORKERS = 2  # сколько файлов транскрибировать параллельно (по умолчанию подбирается по ядрам и памяти)
+# MAX_QUEUE = 20  # сколько задач может ждать в очереди
+# PROGRESS_INTERVAL = 3  # не чаще скольких секунд обновлять сообщение с прогрессом
+# MODEL_RAM_BUDGET_MB = 800  # сколько памяти можно отдать под модели (по умолчанию 70% ОЗУ)
+# CACHE_MAX_MB = 200  # размер кэша готовых транскрипций results.sqlite
+# MAX_RESUMES = 2  # сколько раз возобновлять задачу из journal.sqlite после перезапусков бота
+# PARALLEL_WORKERS = 4  # длинные записи распознавать кусками в стольких процессах (0 — выключено)
+# LONG_AUDIO_SECONDS = 600  # с какой длины запись считается длинной
+# BATCH_WINDOW_MS = 150  # сколько ждать попутчиков для пакетного распознавания коротких записей (0 — выключено)
+# BATCH_MAX = 8  # сколько коротких записей распознавать одним батчем (не больше WORKERS, с одним воркером батчей нет)
+# VAD_DEFAULT = False  # вырезать тишину перед распознаванием во всех чатах (переключается /vad)
+# OUTPUT_FORMAT = 'txt'  # формат результата по умолчанию: txt, srt, vtt или json (переключается /format)
+# MAX_TEXT_MESSAGES = 3  # текст длиннее стольких сообщений присылается файлом
+# MAX_DOWNLOAD_MB = 2048  # лимит размера файла по ссылке
+# TELEGRAM_MAX_MB = 2000  # лимит размера файла, присланного в Telegram
+# PCM_IN_MEMORY_MB = 256  # более длинный PCM декодируется в файл на диске и читается через mmap
+# PCM_SPILL_DIR = None  # куда писать этот файл (по умолчанию /var/tmp, не tmpfs)
+# PCM_SPILL_QUOTA_MB = 4096  # сколько места такие файлы могут занять вместе
+# WORKSPACE_DIR = None  # где создавать временные папки задач (по умолчанию /dev/shm)
+# WORKSPACE_QUOTA_MB = 1024  # сколько места они могут занять вместе
+# METRICS_PORT = 9100  # поднять http://127.0.0.1:9100/metrics для Prometheus
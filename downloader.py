@@ -0,0 +1,278 @@
+"""Асинхронное скачивание файлов по ссылке и из Telegram с докачкой и параллельными кусками.
+
+Если сервер отдает Content-Length и поддерживает Range, большой файл
+качается SEGMENTS кусками одновременно, каждый кусок при обрыве докачивается
+с места остановки. Иначе файл качается одним потоком, тоже с докачкой.
+Файлы из Telegram качаются так же, кусками через iter_download.
+Скачанные байты по порядку отдаются в sink, так что декодирование может
+начаться раньше, чем закончится скачивание.
+"""
+import asyncio
+
+import aiohttp
+
+SEGMENTS = 4
+SEGMENT_MIN_BYTES = 8 * 1024 * 1024  # файлы меньше качаются одним потоком
+CHUNK_BYTES = 256 * 1024
+RETRIES = 5
+RETRY_STATUSES = {429}  # кроме 5xx: сервер временно не может ответить, стоит повторить
+TIMEOUT = aiohttp.ClientTimeout(total=None, connect=30, sock_read=60)
+
+TG_REQUEST_BYTES = 512 * 1024  # максимальный размер одного upload.getFile
+TG_PART_BYTES = 8 * TG_REQUEST_BYTES  # кусок, который качает одна корутина
+TG_PARALLEL = 4  # сколько кусков качать одновременно
+
+
+class DownloadError(Exception):
+    """Файл не удалось скачать"""
+
+
+class _Segment:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end  # не включительно, None — до конца файла
+        self.done = 0
+
+    @property
+    def complete(self):
+        return self.end is not None and self.start + self.done >= self.end
+
+
+class Download:
+    """Скачивание одного файла в path.
+
+    progress(done, total) вызывается на каждом куске данных, total может
+    быть None. sink(data) — корутина, получающая байты строго по порядку.
+    """
+
+    def __init__(self, url, path, max_bytes=None, progress=None, sink=None):
+        self.url = url
+        self.path = path
+        self.max_bytes = max_bytes
+        self.progress = progress
+        self.sink = sink
+        self.total = None
+        self._segments = []
+        self._advanced = asyncio.Event()
+        self._finished = False
+
+    @property
+    def done(self):
+        return sum(segment.done for segment in self._segments)
+
+    async def run(self):
+        async with aiohttp.ClientSession(timeout=TIMEOUT) as session:
+            ranges = await self._probe(session)
+            if self.total is not None and ranges and self.total >= SEGMENT_MIN_BYTES:
+                size = -(-self.total // SEGMENTS)
+                self._segments = [_Segment(start, min(start + size, self.total))
+                                  for start in range(0, self.total, size)]
+            else:
+                self._segments = [_Segment(0, self.total)]
+
+            # файл создается заранее нужного размера, куски пишутся по своим смещениям
+            with open(self.path, 'wb') as f:
+                if self.total:
+                    f.truncate(self.total)
+
+            feeder = asyncio.create_task(self._feed()) if self.sink else None
+            fetchers = [asyncio.create_task(self._fetch(session, segment)) for segment in self._segments]
+            try:
+                await asyncio.gather(*fetchers)
+            except BaseException:
+                tasks = [task for task in fetchers + [feeder] if task is not None]
+                for task in tasks:
+                    task.cancel()
+                # дожидаемся отмененных задач, чтобы их ошибки не остались непрочитанными
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            self._finished = True
+            self._advanced.set()
+            if feeder is not None:
+                await feeder
+        return self.path
+
+    async def _probe(self, session):
+        """Узнает размер файла и поддержку Range, проверяет лимит размера"""
+        try:
+            async with session.head(self.url, allow_redirects=True) as response:
+                if response.status < 400:
+                    self.total = response.content_length
+                    ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                else:
+                    ranges = False
+        except aiohttp.ClientError:
+            ranges = False
+        self._check_size(self.total)
+        return ranges
+
+    def _check_size(self, size):
+        if size is not None and self.max_bytes is not None and size > self.max_bytes:
+            raise DownloadError(f"Файл слишком большой: {size // (1024 * 1024)} МБ, "
+                                f"лимит {self.max_bytes // (1024 * 1024)} МБ")
+
+    async def _fetch(self, session, segment):
+        attempt = 0
+        while not segment.complete:
+            headers = {}
+            position = segment.start + segment.done
+            if position or segment.end is not None and segment.end != self.total:
+                end = '' if segment.end is None else segment.end - 1
+                headers['Range'] = f"bytes={position}-{end}"
+            try:
+                async with session.get(self.url, headers=headers) as response:
+                    if response.status >= 500 or response.status in RETRY_STATUSES:
+                        response.raise_for_status()  # повторяем ниже, как обрыв соединения
+                    if response.status >= 400:
+                        raise DownloadError(f"Сервер ответил {response.status}")
+                    if headers and response.status != 206:
+                        if len(self._segments) > 1:
+                            raise DownloadError("Сервер перестал поддерживать докачку")
+                        # сервер игнорирует Range — начинаем заново
+                        segment.done = 0
+                    if self.total is None and response.content_length is not None and not headers:
+                        self.total = segment.end = response.content_length
+                        self._check_size(self.total)
+                    await self._write(segment, response)
+                if segment.end is None:
+                    # размер был неизвестен, поток закончился — значит файл скачан
+                    segment.end = self.total = segment.start + segment.done
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                attempt += 1
+                if attempt > RETRIES:
+                    if isinstance(e, aiohttp.ClientResponseError):
+                        raise DownloadError(f"Сервер ответил {e.status}")
+                    raise DownloadError(f"Обрыв соединения: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def _write(self, segment, response):
+        with open(self.path, 'r+b') as f:
+            f.seek(segment.start + segment.done)
+            async for data in response.content.iter_chunked(CHUNK_BYTES):
+                if segment.end is not None:
+                    data = data[:segment.end - segment.start - segment.done]
+                f.write(data)
+                segment.done += len(data)
+                self._check_size(segment.start + segment.done)
+                self._written(f)
+                if segment.complete:
+                    break
+
+    def _written(self, f):
+        """Сообщает о новых байтах прогрессу и отправителю в sink"""
+        if self.progress is not None:
+            self.progress(self.done, self.total)
+        if self.sink is not None:
+            f.flush()
+            self._advanced.set()
+
+    def _frontier(self):
+        """До какого байта файл скачан без дыр"""
+        frontier = 0
+        for segment in self._segments:
+            frontier = segment.start + segment.done
+            if not segment.complete:
+                break
+        return frontier
+
+    async def _feed(self):
+        fed = 0
+        # без буфера: файл дописывается через другие дескрипторы
+        with open(self.path, 'rb', buffering=0) as f:
+            while True:
+                await self._advanced.wait()
+                self._advanced.clear()
+                finished = self._finished
+                frontier = self._frontier()
+                while fed < frontier:
+                    f.seek(fed)
+                    data = f.read(min(CHUNK_BYTES, frontier - fed))
+                    fed += len(data)
+                    await self.sink(data)
+                if finished:
+                    return
+
+
+async def download(url, path, max_bytes=None, progress=None, sink=None):
+    """Скачивает url в path, см. Download"""
+    return await Download(url, path, max_bytes, progress, sink).run()
+
+
+class TelegramDownload(Download):
+    """Скачивание медиа из Telegram несколькими запросами одновременно.
+
+    Файл делится на куски по TG_PART_BYTES, TG_PARALLEL корутин берут их
+    по порядку и качают через client.iter_download со своего смещения.
+    Запросы к DC файла идут параллельно, поэтому скорость не упирается
+    в задержку одного запроса, как у download_media.
+    """
+
+    def __init__(self, client, media, size, path, progress=None, sink=None, parallel=TG_PARALLEL):
+        super().__init__(None, path, progress=progress, sink=sink)
+        self.client = client
+        self.media = media
+        self.total = size
+        self.parallel = parallel
+
+    async def run(self):
+        self._segments = [_Segment(start, min(start + TG_PART_BYTES, self.total))
+                          for start in range(0, self.total, TG_PART_BYTES)]
+        with open(self.path, 'wb') as f:
+            f.truncate(self.total)
+
+        parts = iter(self._segments)  # общий для всех корутин, куски раздаются по порядку
+
+        async def worker():
+            for segment in parts:
+                await self._fetch_part(segment)
+
+        feeder = asyncio.create_task(self._feed()) if self.sink else None
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.parallel, len(self._segments)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            tasks = [task for task in workers + [feeder] if task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        self._finished = True
+        self._advanced.set()
+        if feeder is not None:
+            await feeder
+        return self.path
+
+    async def _fetch_part(self, segment):
+        from telethon.errors import RPCError
+
+        attempt = 0
+        while not segment.complete:
+            position = segment.start + segment.done
+            chunks = -(-(segment.end - position) // TG_REQUEST_BYTES)
+            try:
+                with open(self.path, 'r+b') as f:
+                    f.seek(position)
+                    # смещение всегда кратно TG_REQUEST_BYTES: куски и запросы выровнены
+                    async for data in self.client.iter_download(
+                            self.media, offset=position, limit=chunks,
+                            request_size=TG_REQUEST_BYTES, file_size=self.total):
+                        data = data[:segment.end - segment.start - segment.done]
+                        f.write(data)
+                        segment.done += len(data)
+                        self._written(f)
+                        if segment.complete:
+                            break
+                if segment.start + segment.done == position:
+                    raise DownloadError("Telegram отдал файл не полностью")
+            except (ConnectionError, asyncio.TimeoutError, RPCError) as e:
+                if isinstance(e, RPCError) and (e.code or 0) < 500:
+                    raise
+                attempt += 1
+                if attempt > RETRIES:
+                    raise DownloadError(f"Не удалось скачать файл из Telegram: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+
+async def download_media(client, media, size, path, progress=None, sink=None):
+    """Скачивает медиа из Telegram в path, см. TelegramDownload"""
+    return await TelegramDownload(client, media, size, path, progress, sink).run()
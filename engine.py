@@ -0,0 +1,184 @@
+"""Потоковая транскрипция поверх модели whisper без патчей site-packages.
+
+Повторяет основной цикл whisper.transcribe: аудио режется на 30-секундные
+окна, каждое окно декодируется через model.decode с фолбэком по температуре,
+а таймстемп-токены превращаются в сегменты. В отличие от оригинала,
+сегменты и прогресс отдаются по мере декодирования, а не в конце.
+"""
+import torch
+from whisper.audio import HOP_LENGTH, N_FRAMES, N_SAMPLES, SAMPLE_RATE, log_mel_spectrogram
+from whisper.decoding import DecodingOptions
+from whisper.tokenizer import get_tokenizer
+
+from inference import iterate_in_executor
+from transcript import Progress, Segment, Transcript
+
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+def mel_window(model, audio, seek, segment_size=N_FRAMES):
+    """Лог-мел спектрограмма одного 30-секундного окна, начиная с кадра seek"""
+    chunk = torch.as_tensor(audio[seek * HOP_LENGTH: seek * HOP_LENGTH + N_SAMPLES])
+    if chunk.shape[-1] < N_SAMPLES:
+        chunk = torch.nn.functional.pad(chunk, (0, N_SAMPLES - chunk.shape[-1]))
+    mel = log_mel_spectrogram(chunk, model.dims.n_mels)
+    if segment_size < N_FRAMES:
+        # как в whisper: хвост неполного окна заполняется нулями
+        mel[:, segment_size:] = 0
+    return mel.to(model.device)
+
+
+def detect_language(model, mel):
+    if not model.is_multilingual:
+        return 'en'
+    _, probs = model.detect_language(mel)
+    return max(probs, key=probs.get)
+
+
+def needs_fallback(result):
+    """Модель зациклилась или не уверена — окно стоит передекодировать с температурой"""
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD:
+        return False  # тишина
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+
+def is_silence(result):
+    """Окно без речи, его сегменты выкидываются"""
+    return result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob <= LOGPROB_THRESHOLD
+
+
+def decode_with_fallback(model, mel, prompt, language, temperatures=TEMPERATURES):
+    """Декодирует окно, повышая температуру при зацикливании или низкой уверенности"""
+    result = None
+    for t in temperatures:
+        options = DecodingOptions(language=language, temperature=t, prompt=prompt, fp16=False)
+        result = model.decode(mel, options)
+        if not needs_fallback(result):
+            break
+    return result
+
+
+def split_segments(tokens, tokenizer, time_offset, segment_size):
+    """Режет токены окна на сегменты по таймстемпам.
+
+    Возвращает сегменты и сколько кадров окна реально обработано.
+    """
+    time_precision = 2 * HOP_LENGTH / SAMPLE_RATE  # 0.02 c на таймстемп-токен
+    is_timestamp = [token >= tokenizer.timestamp_begin for token in tokens]
+    single_timestamp_ending = is_timestamp[-2:] == [False, True]
+    consecutive = [i + 1 for i in range(len(tokens) - 1) if is_timestamp[i] and is_timestamp[i + 1]]
+
+    def make(start, end, segment_tokens):
+        text_tokens = [token for token in segment_tokens if token < tokenizer.eot]
+        return Segment(start, end, tokenizer.decode(text_tokens), segment_tokens)
+
+    segments = []
+    if consecutive:
+        slices = consecutive + ([len(tokens)] if single_timestamp_ending else [])
+        last_slice = 0
+        for current_slice in slices:
+            sliced = tokens[last_slice:current_slice]
+            start = (sliced[0] - tokenizer.timestamp_begin) * time_precision
+            end = (sliced[-1] - tokenizer.timestamp_begin) * time_precision
+            segments.append(make(time_offset + start, time_offset + end, sliced))
+            last_slice = current_slice
+        if single_timestamp_ending:
+            consumed = segment_size
+        else:
+            # недоговоренный сегмент выкидываем и продолжаем с последнего таймстемпа
+            consumed = (tokens[last_slice - 1] - tokenizer.timestamp_begin) * 2
+    else:
+        duration = segment_size * HOP_LENGTH / SAMPLE_RATE
+        timestamps = [token for token, ts in zip(tokens, is_timestamp) if ts]
+        if timestamps and timestamps[-1] != tokenizer.timestamp_begin:
+            duration = (timestamps[-1] - tokenizer.timestamp_begin) * time_precision
+        segments.append(make(time_offset, time_offset + duration, tokens))
+        consumed = segment_size
+    return segments, consumed or segment_size
+
+
+def available_frames(audio, seek):
+    """Сколько кадров можно обработать. Для дописываемого PCM (ingest.PCMStream)
+    ждет, пока наберется полное окно или поток закончится"""
+    wait = getattr(audio, 'wait', None)
+    if wait is None:
+        return len(audio) // HOP_LENGTH
+    return wait((seek + N_FRAMES) * HOP_LENGTH) // HOP_LENGTH
+
+
+def transcribe_iter(model, audio, language=None):
+    """Синхронный генератор: отдает Segment и Progress, возвращает Transcript.
+
+    audio — float32 PCM 16 кГц моно, массив или дописываемый PCMStream.
+    Выполнять в потоке инференса.
+    """
+    seek = 0
+    all_tokens = []
+    prompt_reset_since = 0
+    segments = []
+    tokenizer = None
+
+    def progress():
+        done = min(seek, content_frames) * HOP_LENGTH / SAMPLE_RATE
+        total = max(getattr(audio, 'expected', None) or 0, content_frames * HOP_LENGTH) / SAMPLE_RATE
+        return Progress(done, total)
+
+    with torch.inference_mode():
+        while True:
+            content_frames = available_frames(audio, seek)
+            if seek >= content_frames:
+                break
+            segment_size = min(N_FRAMES, content_frames - seek)
+            time_offset = seek * HOP_LENGTH / SAMPLE_RATE
+            mel = mel_window(model, audio, seek, segment_size)
+
+            if tokenizer is None:
+                language = language or detect_language(model, mel)
+                tokenizer = get_tokenizer(
+                    model.is_multilingual, num_languages=model.num_languages,
+                    language=language, task='transcribe',
+                )
+
+            result = decode_with_fallback(model, mel, all_tokens[prompt_reset_since:], language)
+
+            # окно без речи пропускаем целиком
+            if is_silence(result):
+                seek += segment_size
+                yield progress()
+                continue
+
+            current, consumed = split_segments(result.tokens, tokenizer, time_offset, segment_size)
+            seek += consumed
+            for segment in current:
+                if segment.start == segment.end or not segment.text.strip():
+                    continue
+                segments.append(segment)
+                all_tokens.extend(segment.tokens)
+                yield segment
+
+            if result.temperature > 0.5:
+                # после высокой температуры не подаем предыдущий текст как промпт
+                prompt_reset_since = len(all_tokens)
+
+            yield progress()
+
+    return Transcript(segments, language)
+
+
+def transcribe(model, audio, language=None):
+    """Транскрипция целиком, без промежуточных событий"""
+    gen = transcribe_iter(model, audio, language)
+    while True:
+        try:
+            next(gen)
+        except StopIteration as e:
+            return e.value
+
+
+async def transcribe_stream(model, audio, language=None):
+    """Асинхронный итератор по событиям транскрипции, инференс идет в пуле потоков"""
+    async for event in iterate_in_executor(transcribe_iter, model, audio, language):
+        yield event
@@ -0,0 +1,126 @@
+"""Форматы результата: текст, SRT, VTT и JSON с таймстемпами.
+
+Документ собирается по мере того, как приходят сегменты: add() сразу
+дописывает кусок в файл (или в память) и возвращает его, так что
+результат не нужно держать целиком и пересобирать в конце.
+"""
+import io
+import json
+import os
+
+FORMATS = {
+    'txt': 'текст',
+    'srt': 'субтитры SRT',
+    'vtt': 'субтитры WebVTT',
+    'json': 'JSON с таймстемпами',
+}
+
+
+def timestamp(seconds, separator=','):
+    """01:02:03,456 для SRT, 01:02:03.456 для VTT"""
+    ms = int(round(seconds * 1000))
+    hours, ms = divmod(ms, 3600 * 1000)
+    minutes, ms = divmod(ms, 60 * 1000)
+    secs, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{ms:03d}"
+
+
+class Formatter:
+    """Превращает поток сегментов в документ: header, по куску на сегмент, footer"""
+    ext = 'txt'
+
+    def __init__(self):
+        self.count = 0
+
+    def header(self):
+        return ''
+
+    def segment(self, segment):
+        raise NotImplementedError
+
+    def footer(self, language):
+        return ''
+
+
+class TextFormatter(Formatter):
+    def segment(self, segment):
+        return segment.text.lstrip() if self.count == 1 else segment.text
+
+    def footer(self, language):
+        return '\n' if self.count else ''
+
+
+class SRTFormatter(Formatter):
+    ext = 'srt'
+
+    def segment(self, segment):
+        return (f"{self.count}\n{timestamp(segment.start)} --> {timestamp(segment.end)}\n"
+                f"{segment.text.strip()}\n\n")
+
+
+class VTTFormatter(Formatter):
+    ext = 'vtt'
+
+    def header(self):
+        return 'WEBVTT\n\n'
+
+    def segment(self, segment):
+        return f"{timestamp(segment.start, '.')} --> {timestamp(segment.end, '.')}\n{segment.text.strip()}\n\n"
+
+
+class JSONFormatter(Formatter):
+    ext = 'json'
+
+    def header(self):
+        return '{"segments": [\n'
+
+    def segment(self, segment):
+        item = json.dumps({'start': round(segment.start, 3), 'end': round(segment.end, 3),
+                           'text': segment.text.strip()}, ensure_ascii=False)
+        return ('' if self.count == 1 else ',\n') + '  ' + item
+
+    def footer(self, language):
+        return f"\n], \"language\": {json.dumps(language)}}}\n"
+
+
+FORMATTERS = {
+    'txt': TextFormatter,
+    'srt': SRTFormatter,
+    'vtt': VTTFormatter,
+    'json': JSONFormatter,
+}
+
+
+class Document:
+    """Документ в одном из FORMATS, пишется файлом в directory или в память"""
+
+    def __init__(self, fmt, name, directory=None):
+        self.formatter = FORMATTERS[fmt]()
+        self.name = f"{name}.{self.formatter.ext}"
+        self.path = os.path.join(directory, self.name) if directory else None
+        self._file = open(self.path, 'w', encoding='utf-8') if self.path else io.StringIO()
+        self.chars = 0
+        self._write(self.formatter.header())
+
+    def _write(self, text):
+        self._file.write(text)
+        self.chars += len(text)
+        return text
+
+    def add(self, segment):
+        """Дописывает сегмент и возвращает добавленный кусок"""
+        self.formatter.count += 1
+        return self._write(self.formatter.segment(segment))
+
+    def close(self, language=None):
+        self._write(self.formatter.footer(language))
+        if self.path:
+            self._file.close()
+
+    def upload(self):
+        """Файл для send_file: путь на диске или байты с именем"""
+        if self.path:
+            return self.path
+        data = io.BytesIO(self._file.getvalue().encode('utf-8'))
+        data.name = self.name
+        return data
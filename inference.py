@@ -0,0 +1,92 @@
+"""Запуск блокирующего инференса whisper вне event loop телетона"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Отдельный пул для инференса, чтобы event loop оставался свободным.
+# Размер пула задается через init_executor по числу воркеров очереди
+INFERENCE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='whisper')
+
+
+def init_executor(workers):
+    """Пересоздает пул инференса под нужное число параллельных задач"""
+    global INFERENCE_EXECUTOR
+    INFERENCE_EXECUTOR.shutdown(wait=False)
+    INFERENCE_EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='whisper')
+
+
+_DONE = object()
+
+
+class _Result:
+    """Возвращаемое значение генератора (StopIteration.value)"""
+    def __init__(self, value):
+        self.value = value
+
+
+class _Error:
+    """Исключение, упавшее в рабочем потоке"""
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _drive(gen_factory, args, kwargs, put, stop):
+    """Крутит генератор в рабочем потоке и пересылает элементы в очередь"""
+    try:
+        gen = gen_factory(*args, **kwargs)
+        if not hasattr(gen, '__next__'):
+            # обычная функция: отдаем ее результат как единственный элемент
+            put(_Result(gen))
+            return
+        try:
+            while not stop.is_set():
+                try:
+                    item = next(gen)
+                except StopIteration as e:
+                    put(_Result(e.value))
+                    break
+                put(item)
+        finally:
+            gen.close()
+    except BaseException as e:
+        put(_Error(e))
+    finally:
+        put(_DONE)
+
+
+async def iterate_in_executor(gen_factory, *args, executor=None, **kwargs):
+    """Выполняет gen_factory(*args, **kwargs) в пуле потоков и стримит элементы в event loop.
+
+    Элементы генератора отдаются по мере появления, возвращаемое значение
+    генератора отдается последним. Если потребитель перестал итерироваться
+    (отмена задачи, break), рабочий поток останавливается на следующем шаге.
+    """
+    loop = asyncio.get_running_loop()
+    executor = executor or INFERENCE_EXECUTOR
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # event loop уже закрыт, результат никому не нужен
+            stop.set()
+
+    future = loop.run_in_executor(executor, _drive, gen_factory, args, kwargs, put, stop)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Error):
+                raise item.exc
+            if isinstance(item, _Result):
+                if item.value is not None:
+                    yield item.value
+                continue
+            yield item
+        await future
+    finally:
+        stop.set()
+
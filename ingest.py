@@ -0,0 +1,213 @@
+"""Декодирование любого аудио/видео в 16 кГц моно float32 PCM одним процессом ffmpeg.
+
+Видеодорожка не декодируется (-vn), промежуточные файлы не пишутся:
+ffmpeg отдает сырой PCM в stdout, и он сразу становится массивом numpy.
+StreamDecoder принимает байты файла по мере скачивания, и распознавание
+может начаться, пока файл еще качается. probe() заранее узнает через
+ffprobe, есть ли в файле звук и сколько места займет его PCM.
+"""
+import asyncio
+import json
+import subprocess
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+class IngestError(Exception):
+    """ffmpeg не смог прочитать входной файл"""
+
+
+@dataclass
+class MediaInfo:
+    """Что ffprobe нашел в файле"""
+    container: str
+    codec: str
+    duration: float  # 0, если контейнер не знает длительность
+
+    @property
+    def pcm_bytes(self):
+        """Размер декодированного 16 кГц моно float32 PCM"""
+        return int(self.duration * SAMPLE_RATE) * 4
+
+
+async def probe(path):
+    """Читает заголовки файла ffprobe, не декодируя его"""
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-of', 'json',
+        '-show_entries', 'format=format_name,duration:stream=codec_type,codec_name,duration',
+        path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        out, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    if process.returncode != 0:
+        raise IngestError(f"Не удалось прочитать файл: {stderr.decode(errors='replace')}")
+    info = json.loads(out or b'{}')
+    streams = [s for s in info.get('streams', []) if s.get('codec_type') == 'audio']
+    if not streams:
+        raise IngestError("В файле нет звуковой дорожки")
+    container = info.get('format', {})
+    duration = container.get('duration') or streams[0].get('duration') or 0
+    return MediaInfo(container.get('format_name', ''), streams[0].get('codec_name', ''), float(duration))
+
+
+def ffmpeg_command(source, output='pipe:1'):
+    return [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-threads', '0',
+        '-i', source,
+        '-vn', '-sn', '-dn',
+        '-f', 'f32le', '-acodec', 'pcm_f32le',
+        '-ac', '1', '-ar', str(SAMPLE_RATE),
+        '-y', output,
+    ]
+
+
+def _to_array(raw, mmap_path):
+    if mmap_path is not None:
+        return np.memmap(mmap_path, dtype=np.float32, mode='r')
+    return np.frombuffer(raw, dtype=np.float32)
+
+
+def load_audio(path, mmap_path=None):
+    """Синхронная версия decode_audio для потоков инференса"""
+    result = subprocess.run(ffmpeg_command(path, mmap_path or 'pipe:1'), capture_output=True)
+    if result.returncode != 0:
+        raise IngestError(f"Не удалось декодировать аудио: {result.stderr.decode(errors='replace')}")
+    return _to_array(result.stdout, mmap_path)
+
+
+async def decode_audio(path, mmap_path=None):
+    """Декодирует файл в PCM, не блокируя event loop.
+
+    Если задан mmap_path, PCM пишется туда и возвращается как np.memmap —
+    для длинных записей, которые не хочется держать в куче целиком.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *ffmpeg_command(path, mmap_path or 'pipe:1'),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        raw, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    if process.returncode != 0:
+        raise IngestError(f"Не удалось декодировать аудио: {stderr.decode(errors='replace')}")
+    return _to_array(raw, mmap_path)
+
+
+class PCMStream:
+    """PCM, который еще дописывается декодером.
+
+    Пишется из event loop, читается из потока инференса: wait() блокирует,
+    пока не наберется нужное число сэмплов или поток не закончится.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self.finished = False
+        self.error = None
+        self.expected = None  # оценка полной длины в сэмплах, если известна
+
+    def append(self, data):
+        with self._cond:
+            self._buf.extend(data)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.finished = True
+            self.error = error
+            self._cond.notify_all()
+
+    def wait(self, samples):
+        """Ждет, пока будет доступно samples сэмплов, возвращает сколько доступно"""
+        with self._cond:
+            while not self.finished and len(self._buf) // 4 < samples:
+                self._cond.wait()
+            if self.error is not None:
+                raise self.error
+            return len(self._buf) // 4
+
+    def __len__(self):
+        return len(self._buf) // 4
+
+    def __getitem__(self, key):
+        with self._cond:
+            start, stop, _ = key.indices(len(self._buf) // 4)
+            return np.frombuffer(bytes(self._buf[start * 4:stop * 4]), dtype=np.float32)
+
+    def complete(self):
+        """Ждет конца потока и возвращает весь PCM одним массивом"""
+        with self._cond:
+            while not self.finished:
+                self._cond.wait()
+            if self.error is not None:
+                raise self.error
+        return self.array()
+
+    def array(self):
+        """Весь декодированный PCM одним массивом"""
+        with self._cond:
+            return np.frombuffer(bytes(self._buf[:len(self._buf) // 4 * 4]), dtype=np.float32)
+
+
+class StreamDecoder:
+    """ffmpeg, читающий файл из stdin по мере поступления байтов"""
+
+    def __init__(self, total_bytes=None):
+        self.pcm = PCMStream()
+        self.total_bytes = total_bytes
+        self.fed = 0
+        self._process = None
+        self._reader = None
+        self._stderr = None
+
+    async def start(self):
+        self._process = await asyncio.create_subprocess_exec(
+            *ffmpeg_command('pipe:0'),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._reader = asyncio.create_task(self._read())
+        self._stderr = asyncio.create_task(self._process.stderr.read())
+        return self
+
+    async def _read(self):
+        while True:
+            data = await self._process.stdout.read(64 * 1024)
+            if not data:
+                return
+            self.pcm.append(data)
+            if self.total_bytes and self.fed:
+                self.pcm.expected = int(len(self.pcm) * self.total_bytes / self.fed)
+
+    async def feed(self, data):
+        self._process.stdin.write(data)
+        self.fed += len(data)
+        await self._process.stdin.drain()
+
+    async def close(self, error=None):
+        """Завершает поток: без ошибки — дожидается конца декодирования"""
+        if error is not None:
+            self._process.kill()
+            await self._process.wait()
+            self.pcm.finish(error)
+            return
+        self._process.stdin.close()
+        await self._reader
+        stderr = await self._stderr
+        await self._process.wait()
+        if self._process.returncode != 0:
+            self.pcm.finish(IngestError(f"Не удалось декодировать аудио: {stderr.decode(errors='replace')}"))
+        else:
+            self.pcm.expected = len(self.pcm)
+            self.pcm.finish()
@@ -0,0 +1,184 @@
+"""Очередь задач на транскрипцию с несколькими воркерами и честностью между чатами"""
+import asyncio
+import itertools
+import os
+import time
+import traceback
+from collections import OrderedDict, deque
+
+from registry import estimate_model_mb
+
+
+def default_workers(model_name):
+    """Число параллельных воркеров исходя из ядер и свободной памяти"""
+    cores = os.cpu_count() or 1
+    workers = max(1, cores // 2)
+    try:
+        import psutil
+        available_mb = psutil.virtual_memory().available // (1024 * 1024)
+        workers = min(workers, max(1, int(available_mb // estimate_model_mb(model_name))))
+    except ImportError:
+        pass
+    return workers
+
+
+class QueueFull(Exception):
+    """Очередь заполнена, задача не принята"""
+
+
+class Job:
+    """Задача на транскрипцию одного файла или ссылки"""
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id, title, run):
+        self.id = next(self._ids)
+        self.chat_id = chat_id
+        self.title = title
+        self.run = run  # async def run(job)
+        self.state = 'queued'
+        self.created = time.time()
+        self.started = None
+        self.status_msg = None
+        self.task = None
+        self.workspace = None  # временная папка, пока задача выполняется
+        self.record = None  # запись в журнале, если задачу можно возобновить после перезапуска
+
+    def describe(self):
+        if self.state == 'running':
+            return f"#{self.id} {self.title} — выполняется {int(time.time() - self.started)} с"
+        return f"#{self.id} {self.title} — в очереди"
+
+
+class JobScheduler:
+    """Ограниченная очередь задач с пулом воркеров.
+
+    Задачи разных чатов выбираются по кругу, чтобы один чат с кучей файлов
+    не задерживал остальных. on_position(job, position) вызывается, когда
+    позиция ожидающей задачи в очереди меняется, on_start(job) — перед запуском.
+    """
+
+    def __init__(self, workers=1, max_queue=20, on_position=None, on_start=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.on_position = on_position
+        self.on_start = on_start
+        self._pending = OrderedDict()  # chat_id -> deque[Job]
+        self._running = {}  # job.id -> Job
+        self._positions = {}  # job.id -> последняя сообщенная позиция
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+
+    async def stop(self):
+        for job in self._running.values():
+            if job.task is not None:
+                job.task.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def pending(self):
+        """Ожидающие задачи в порядке, в котором их возьмут воркеры"""
+        queues = [list(q) for q in self._pending.values()]
+        return [job for batch in itertools.zip_longest(*queues) for job in batch if job is not None]
+
+    def running(self):
+        return list(self._running.values())
+
+    def position(self, job):
+        for n, pending in enumerate(self.pending(), start=1):
+            if pending is job:
+                return n
+        return 0
+
+    def submit(self, job):
+        """Ставит задачу в очередь и возвращает ее позицию"""
+        if sum(len(q) for q in self._pending.values()) >= self.max_queue:
+            raise QueueFull(f"В очереди уже {self.max_queue} задач, попробуйте позже")
+        self._pending.setdefault(job.chat_id, deque()).append(job)
+        self._wakeup.set()
+        position = self.position(job)
+        self._positions[job.id] = position
+        # задача другого чата встает в круг перед задачами, которые уже ждут
+        self._notify_positions()
+        return position
+
+    def cancel(self, chat_id, job_id=None):
+        """Отменяет задачи чата (все или одну) и возвращает список отмененных"""
+        cancelled = []
+        queue = self._pending.get(chat_id)
+        if queue:
+            for job in list(queue):
+                if job_id is None or job.id == job_id:
+                    queue.remove(job)
+                    job.state = 'cancelled'
+                    self._positions.pop(job.id, None)
+                    cancelled.append(job)
+            if not queue:
+                del self._pending[chat_id]
+        for job in list(self._running.values()):
+            if job.chat_id == chat_id and (job_id is None or job.id == job_id):
+                job.state = 'cancelled'
+                if job.task is not None:
+                    job.task.cancel()
+                cancelled.append(job)
+        if cancelled:
+            self._notify_positions()
+        return cancelled
+
+    def _pop(self):
+        chat_id, queue = next(iter(self._pending.items()))
+        job = queue.popleft()
+        # чат уходит в конец круга, даже если у него остались задачи
+        del self._pending[chat_id]
+        if queue:
+            self._pending[chat_id] = queue
+        self._positions.pop(job.id, None)
+        return job
+
+    def _notify_positions(self):
+        if self.on_position is None:
+            return
+        for n, job in enumerate(self.pending(), start=1):
+            if self._positions.get(job.id) != n:
+                self._positions[job.id] = n
+                asyncio.create_task(self._safe(self.on_position, job, n))
+
+    @staticmethod
+    async def _safe(callback, *args):
+        try:
+            await callback(*args)
+        except Exception as e:
+            print(f"Ошибка в обработчике очереди: {e}")
+
+    async def _worker(self, n):
+        while True:
+            while not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            job = self._pop()
+            self._notify_positions()
+            job.state = 'running'
+            job.started = time.time()
+            self._running[job.id] = job
+            try:
+                if self.on_start is not None:
+                    await self._safe(self.on_start, job)
+                if job.state == 'cancelled':
+                    continue
+                # отдельная таска, чтобы /cancel отменял задачу, а не воркер
+                job.task = asyncio.create_task(job.run(job))
+                await asyncio.wait({job.task})
+                if job.task.cancelled():
+                    job.state = 'cancelled'
+                elif job.task.exception() is not None:
+                    job.state = 'failed'
+                    traceback.print_exception(job.task.exception())
+                else:
+                    job.state = 'done'
+            finally:
+                self._running.pop(job.id, None)
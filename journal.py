@@ -0,0 +1,148 @@
+"""Журнал задач на диске (SQLite в режиме WAL).
+
+Каждая принятая задача записывается вместе с источником (сообщение
+телеграма или ссылка), этапом и уже распознанными сегментами. Запись
+удаляется, когда задача завершилась. Если бот упал или перезапустился,
+оставшиеся записи при старте снова ставятся в очередь, и распознавание
+продолжается с последнего завершенного 30-секундного окна, а не с начала.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from transcript import Progress, Segment, Transcript
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    source TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    checkpoint REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    job_id INTEGER NOT NULL,
+    start REAL NOT NULL,
+    stop REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_job ON segments (job_id, start);
+"""
+
+WINDOW_SECONDS = 30
+
+
+def completed(segments, checkpoint=0.0, window=WINDOW_SECONDS):
+    """Сегменты до границы последнего целиком распознанного окна.
+
+    Сегменты окна сохраняются подряд, но бот мог упасть посередине,
+    поэтому хвост после последней границы окна распознается заново.
+    Раньше checkpoint (места, с которого задачу уже возобновляли) не режем.
+    """
+    if not segments:
+        return []
+    boundary = max(checkpoint, segments[-1].end // window * window)
+    return [s for s in segments if s.end <= boundary]
+
+
+def shift_events(events, offset):
+    """Сдвигает таймстемпы и прогресс распознавания хвоста записи на offset секунд"""
+    try:
+        while True:
+            try:
+                event = next(events)
+            except StopIteration as e:
+                transcript = e.value
+                return Transcript([Segment(s.start + offset, s.end + offset, s.text) for s in transcript.segments],
+                                  transcript.language)
+            if isinstance(event, Segment):
+                event = Segment(event.start + offset, event.end + offset, event.text)
+            elif isinstance(event, Progress):
+                event = Progress(event.done + offset, event.total + offset)
+            yield event
+    finally:
+        events.close()
+
+
+class JournalRecord:
+    """Незавершенная задача в журнале"""
+
+    def __init__(self, record_id, chat_id, title, source, stage='queued', attempts=0, segments=()):
+        self.id = record_id
+        self.chat_id = chat_id
+        self.title = title
+        self.source = source  # dict, по которому задачу можно собрать заново, с моделью и VAD
+        self.stage = stage
+        self.attempts = attempts  # сколько раз задачу уже возобновляли
+        self.segments = list(segments)  # сохраненные сегменты, с которых продолжаем
+
+    @property
+    def resume_at(self):
+        """С какой секунды записи продолжать распознавание"""
+        return self.segments[-1].end if self.segments else 0.0
+
+
+class JobJournal:
+    """Журнал задач, переживающий перезапуск бота"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def add(self, chat_id, title, source):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (chat_id, title, source, stage, created, updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (chat_id, title, json.dumps(source, ensure_ascii=False), now, now))
+            self._db.commit()
+        return JournalRecord(cursor.lastrowid, chat_id, title, source)
+
+    def stage(self, record, stage):
+        record.stage = stage
+        with self._lock:
+            self._db.execute("UPDATE jobs SET stage = ?, updated = ? WHERE id = ?", (stage, time.time(), record.id))
+            self._db.commit()
+
+    def add_segment(self, record, segment):
+        with self._lock:
+            self._db.execute("INSERT INTO segments (job_id, start, stop, text) VALUES (?, ?, ?, ?)",
+                             (record.id, segment.start, segment.end, segment.text))
+            self._db.commit()
+
+    def finish(self, record):
+        """Задача завершилась (успешно или нет) — возобновлять ее не нужно"""
+        with self._lock:
+            self._db.execute("DELETE FROM segments WHERE job_id = ?", (record.id,))
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (record.id,))
+            self._db.commit()
+
+    def unfinished(self):
+        """Задачи, прерванные перезапуском, в порядке поступления"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, chat_id, title, source, stage, attempts, checkpoint FROM jobs ORDER BY id").fetchall()
+            records = []
+            for record_id, chat_id, title, source, stage, attempts, checkpoint in rows:
+                segments = [Segment(start, stop, text) for start, stop, text in self._db.execute(
+                    "SELECT start, stop, text FROM segments WHERE job_id = ? ORDER BY start", (record_id,))]
+                records.append(JournalRecord(record_id, chat_id, title, json.loads(source), stage, attempts,
+                                             completed(segments, checkpoint)))
+        return records
+
+    def resume(self, record):
+        """Отмечает попытку возобновления и выкидывает сегменты недописанного окна"""
+        record.attempts += 1
+        with self._lock:
+            self._db.execute("DELETE FROM segments WHERE job_id = ? AND stop > ?", (record.id, record.resume_at))
+            self._db.execute("UPDATE jobs SET attempts = ?, checkpoint = ?, updated = ? WHERE id = ?",
+                             (record.attempts, record.resume_at, time.time(), record.id))
+            self._db.commit()
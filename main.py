@@ -1,22 +1,39 @@
 import os
-import re
 import sys
 import time
 import html as h
+import logging
 import traceback
 import subprocess
-import tempfile
+import threading
 from pathlib import Path
 
-import torch, asyncio
-import whisper
-import moviepy.editor as mp
+import asyncio
 from telethon import TelegramClient, events, Button
 from telethon.tl.types import DocumentAttributeAudio, DocumentAttributeVideo
 
+import conf as settings
 from conf import BOT_TOKEN, API_ID, API_HASH
+from access import Allowlist
+from backends import BACKENDS, available_backends, load_model, model_key, parse_model_key
+from batch import MAX_CLIP_SECONDS, ClipBatcher, fits
+from cache import ResultCache, file_sha256
+from downloader import download, download_media
+from formats import FORMATS, Document
+from ingest import SAMPLE_RATE, StreamDecoder, decode_audio, probe
+from inference import iterate_in_executor, init_executor
+from jobs import Job, JobScheduler, QueueFull, default_workers
+from journal import JobJournal, shift_events
+import metrics
+from metrics import AUDIO_SECONDS, ERRORS, FLOOD_WAITS, JOBS, MODEL_LOAD_SECONDS, REALTIME_FACTOR, REGISTRY, STAGE_SECONDS
+from progress import ProgressReporter
+from registry import ModelRegistry, default_budget_mb
+from transcript import Progress, Segment, Transcript
+from vad import apply_vad, remap_events
+from workspace import QuotaExceeded, Workspaces, disk_root
 
-# Модели Whisper доступные для выбора
+# Модели Whisper доступные для выбора. Каждую можно запустить на любом
+# доступном бэкенде из backends.py, ключ модели тогда "small:int8"
 WHISPER_MODELS = {
     'tiny': 'tiny',
     'base': 'base',
@@ -28,28 +45,169 @@ WHISPER_MODELS = {
     'large-v3': 'large-v3',
     'large-v3-turbo': 'large-v3-turbo',
 }
-message_lock = asyncio.Lock()
 
 DEFAULT_MODEL = 'tiny'
-MODEL = whisper.load_model(DEFAULT_MODEL).to('cpu')
-DEVICE = torch.device('cpu')
-ALLOWED_USERNAMES = ['ressiwage']
-
 dirname = os.path.dirname(__file__)
 join = os.path.join
 
-# Создаем клиент Telethon (без немедленного старта)
-bot = TelegramClient('whisper_bot', API_ID, API_HASH)
+# Кто может пользоваться ботом: ALLOWED_USER_IDS и ALLOWED_USERNAMES в conf.py,
+# правки подхватываются без перезапуска
+ACCESS = Allowlist(settings, default_usernames=['ressiwage'])
+
+
+def model_tag(key):
+    """Ключ модели в виде хэштега: small:int8 -> small_int8"""
+    return key.replace(':', '_')
+
+
+def timed_load_model(key):
+    with MODEL_LOAD_SECONDS.time(model=key):
+        return load_model(key)
+
+
+# Недавно использованные модели держим в памяти в пределах бюджета (МБ, можно задать в conf.py)
+MODEL_RAM_BUDGET_MB = getattr(settings, 'MODEL_RAM_BUDGET_MB', None) or default_budget_mb()
+MODELS = ModelRegistry(timed_load_model, MODEL_RAM_BUDGET_MB)
+
+# Кэш готовых транскрипций, журнал задач и клиент Telegram открываются в setup(),
+# а не при импорте, см. там
+RESULTS = None
+JOURNAL = None
+bot = None
+# Размер кэша в МБ можно задать в conf.py
+CACHE_MAX_MB = getattr(settings, 'CACHE_MAX_MB', 200)
+# Незавершенные задачи переживают перезапуск и продолжаются с места остановки.
+# Задача, прерванная больше MAX_RESUMES раз (например, модель роняет бота по памяти), снимается
+MAX_RESUMES = getattr(settings, 'MAX_RESUMES', 2)
+
+# Временные папки задач (по умолчанию в tmpfs) и их общая квота в МБ
+WORKSPACES = Workspaces(getattr(settings, 'WORKSPACE_DIR', None), getattr(settings, 'WORKSPACE_QUOTA_MB', 1024))
+
+# Число параллельных транскрипций и длина очереди (можно задать в conf.py)
+WORKERS = getattr(settings, 'WORKERS', None) or default_workers(DEFAULT_MODEL)
+MAX_QUEUE = getattr(settings, 'MAX_QUEUE', 20)
+# Не чаще одного обновления прогресса в столько секунд
+PROGRESS_INTERVAL = getattr(settings, 'PROGRESS_INTERVAL', 3)
+# Записи длиннее LONG_AUDIO_SECONDS режутся на куски и распознаются
+# в PARALLEL_WORKERS процессах (0 — выключено)
+PARALLEL_WORKERS = getattr(settings, 'PARALLEL_WORKERS', 0)
+LONG_AUDIO_SECONDS = getattr(settings, 'LONG_AUDIO_SECONDS', 600)
+# Лимит размера файла по ссылке
+MAX_DOWNLOAD_MB = getattr(settings, 'MAX_DOWNLOAD_MB', 2048)
+# Лимит размера файла из Telegram: через MTProto боту доступны файлы до 2 ГБ
+TELEGRAM_MAX_MB = getattr(settings, 'TELEGRAM_MAX_MB', 2000)
+# Эти форматы ffmpeg читает из потока, их можно распознавать, не дожидаясь конца скачивания.
+# У mp4/m4a/mov индекс часто лежит в конце файла, их качаем целиком
+STREAMABLE_EXTENSIONS = ('.mp3', '.ogg', '.oga', '.opus', '.wav', '.flac', '.aac', '.webm', '.mkv', '.mka')
+# Записи не длиннее одного окна whisper качаются целиком: стриминг им почти ничего
+# не дает, а целый файл попадает в батч и в проверку кэша по хэшу.
+# Если длительность неизвестна, короткой считается запись до STREAM_MIN_BYTES
+STREAM_MIN_BYTES = 1024 * 1024
+# PCM длиннее этого (МБ, 256 МБ — около 70 минут) декодируется в файл на диске
+# и читается через mmap, а не держится в куче целиком. Папки задач по умолчанию
+# в tmpfs, то есть тоже в памяти, поэтому файл пишется в PCM_SPILL_DIR
+PCM_IN_MEMORY_MB = getattr(settings, 'PCM_IN_MEMORY_MB', 256)
+SPILL = Workspaces(getattr(settings, 'PCM_SPILL_DIR', None) or disk_root(),
+                   getattr(settings, 'PCM_SPILL_QUOTA_MB', 4096))
+# Короткие записи, пришедшие в пределах BATCH_WINDOW_MS, распознаются
+# одним батчем до BATCH_MAX штук (0 — выключено). Одновременно записей
+# не больше, чем воркеров, так что с одним воркером попутчиков не бывает
+BATCH_WINDOW_MS = getattr(settings, 'BATCH_WINDOW_MS', 150)
+BATCH_MAX = min(getattr(settings, 'BATCH_MAX', 8), WORKERS)
+BATCHER = ClipBatcher(MODELS, BATCH_WINDOW_MS / 1000, BATCH_MAX) if BATCH_WINDOW_MS and BATCH_MAX > 1 else None
+# Текст длиннее стольких сообщений присылается одним файлом
+MAX_TEXT_MESSAGES = getattr(settings, 'MAX_TEXT_MESSAGES', 3)
+# Сколько места в папке задачи резервировать под документ с результатом
+# на секунду записи: с запасом на таймстемпы субтитров и JSON
+DOCUMENT_BYTES_PER_SECOND = 200
+# Порт HTTP-эндпоинта /metrics для Prometheus (None — не поднимать)
+METRICS_PORT = getattr(settings, 'METRICS_PORT', None)
+METRICS_HOST = getattr(settings, 'METRICS_HOST', '127.0.0.1')
+# Настройки чата по умолчанию, меняются командами бота
+CHAT_DEFAULTS = {
+    'vad': getattr(settings, 'VAD_DEFAULT', False),  # вырезать тишину перед распознаванием
+    'format': getattr(settings, 'OUTPUT_FORMAT', 'txt'),  # формат результата, см. formats.FORMATS
+}
+
 
 class Config:
     chat_id = None
     current_model = DEFAULT_MODEL
     is_processing = False  # Флаг для блокировки обработки
+    chats = {}  # chat_id -> настройки чата
+
+    def chat(self, chat_id):
+        return self.chats.setdefault(chat_id, dict(CHAT_DEFAULTS))
 
 conf = Config()
 
-segment_pattern = re.compile(r'\[\d{2}:\d{2}\.\d{3} --> \d{2}:\d{2}\.\d{3}\]\s+(.*)')
 
+def process_uptime():
+    """Сколько секунд назад запущен процесс"""
+    try:
+        import psutil
+        return time.time() - psutil.Process().create_time()
+    except ImportError:
+        return time.time() - metrics.STARTED
+
+
+class Startup:
+    """Готовность к распознаванию.
+
+    torch, whisper и модель по умолчанию грузятся в фоне, пока бот уже
+    подключен и отвечает на команды. Пришедшие за это время файлы ждут
+    в очереди: воркеры запускаются, только когда модель готова.
+    """
+
+    def __init__(self):
+        self.ready = asyncio.Event()
+        self.error = None  # почему модель не загрузилась при запуске
+        self.phases = []  # (этап, секунды)
+
+    def mark(self, name, seconds):
+        self.phases.append((name, seconds))
+        print(f"Запуск: {name} — {seconds:.2f} с")
+
+    def warning(self):
+        """Предупреждение для пользователя, если модель не загрузилась при запуске"""
+        if self.error is None:
+            return None
+        return (f"⚠️ Модель не загрузилась: {self.error}. "
+                f"Попробую загрузить ее еще раз, когда дойдет очередь до распознавания")
+
+    def summary(self):
+        return ", ".join(f"{name} {seconds:.1f} с" for name, seconds in self.phases)
+
+startup = Startup()
+
+
+def warm_up():
+    """Тяжелые импорты и загрузка модели по умолчанию, выполняется в фоновом потоке"""
+    started = time.perf_counter()
+    import torch
+    import engine  # noqa: F401  тянет whisper
+    # Делим ядра между параллельными транскрипциями
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // WORKERS))
+    startup.mark("импорт torch и whisper", time.perf_counter() - started)
+
+    started = time.perf_counter()
+    MODELS.preload(conf.current_model)
+    startup.mark(f"загрузка модели {conf.current_model}", time.perf_counter() - started)
+
+
+async def start_inference():
+    """Прогревает инференс в фоне и после этого запускает воркеры очереди"""
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, warm_up)
+    except Exception as e:
+        # модель попробуют загрузить еще раз при первой задаче
+        startup.error = e
+        print(f"Не удалось подготовить модель: {e}")
+        traceback.print_exc()
+    startup.ready.set()
+    scheduler.start()
+    print(f"Готов к распознаванию через {process_uptime():.1f} с после старта процесса ({startup.summary()})")
 
 async def setup_bot_commands():
     """Устанавливает меню команд для бота"""
@@ -59,7 +217,12 @@ async def setup_bot_commands():
     commands = [
         BotCommand(command="start", description="Начать работу с ботом"),
         BotCommand(command="help", description="Показать справку"),
-        BotCommand(command="model", description="Сменить модель распознавания")
+        BotCommand(command="model", description="Сменить модель распознавания"),
+        BotCommand(command="queue", description="Показать очередь задач"),
+        BotCommand(command="cancel", description="Отменить свои задачи"),
+        BotCommand(command="vad", description="Вкл/выкл пропуск тишины"),
+        BotCommand(command="format", description="Формат результата: текст, SRT, VTT, JSON"),
+        BotCommand(command="stats", description="Статистика и скорость работы")
     ]
     
     await bot(SetBotCommandsRequest(
@@ -75,6 +238,11 @@ def send_help_text():
 /start - Начать работу с ботом
 /help - Показать это сообщение
 /model - Сменить модель распознавания
+/queue - Показать очередь задач
+/cancel - Отменить свои задачи (или /cancel номер)
+/vad - Включить или выключить пропуск тишины перед распознаванием
+/format - Формат результата: текст, субтитры SRT/VTT или JSON с таймстемпами
+/stats - Статистика: очередь, кэш, скорость этапов
 
 <b>Поддерживаемые форматы:</b>
 - Голосовые сообщения
@@ -84,373 +252,978 @@ def send_help_text():
 
 <b>Доступные модели:</b>
 tiny, base, small, medium, large, turbo, large-v2, large-v3, large-v3-turbo
+Любую можно запустить в int8 — так тяжелые модели помещаются в ту же память
 (текущая модель: {})
     """
 
 
-def download_large_file(url, file_path):
-    """Скачивание больших файлов с помощью wget"""
-    try:
-        result = subprocess.run(['wget', '-O', file_path, url],
-                                capture_output=True, text=True, timeout=3600)
-        if result.returncode != 0:
-            raise Exception(f"Ошибка скачивания: {result.stderr}")
-        return True
-    except subprocess.TimeoutExpired:
-        raise Exception("Таймаут скачивания файла")
-    except Exception as e:
-        raise Exception(f"Ошибка при скачивании: {str(e)}")
+async def report_position(job, position):
+    """Обновляет позицию задачи в статусном сообщении"""
+    await bot.edit_message(job.chat_id, job.status_msg,
+                           f"🕐 Задача #{job.id} в очереди, позиция {position}")
+
+
+async def report_start(job):
+    STAGE_SECONDS.observe(job.started - job.created, stage='queue')
+    await bot.edit_message(job.chat_id, job.status_msg, f"▶️ Задача #{job.id}: {job.title}")
+
+
+scheduler = JobScheduler(WORKERS, MAX_QUEUE, on_position=report_position, on_start=report_start)
+
+REGISTRY.gauge('bot_queue_depth', 'Задач в очереди', lambda: len(scheduler.pending()))
+REGISTRY.gauge('bot_jobs_running', 'Задач выполняется', lambda: len(scheduler.running()))
+REGISTRY.gauge('bot_models_resident_mb', 'Память под модели', lambda: MODELS.resident_mb())
+REGISTRY.counter('bot_cache_requests_total', 'Запросы к кэшу результатов',
+                 lambda: [({'result': 'hit'}, RESULTS.hits), ({'result': 'miss'}, RESULTS.misses)])
+if BATCHER is not None:
+    REGISTRY.counter('bot_batched_clips_total', 'Короткие записи, распознанные батчами', lambda: BATCHER.clips)
+    REGISTRY.counter('bot_batches_total', 'Батчи коротких записей', lambda: BATCHER.batches)
+
+
+class FloodWaitLog(logging.Handler):
+    """Считает FloodWait, которые телетон сам выжидает у любых запросов
+    (send_message, send_file, ...) и о которых только пишет в лог"""
+
+    def emit(self, record):
+        if 'flood wait' in str(record.msg):
+            FLOOD_WAITS.inc()
+
+
+telethon_log = logging.getLogger('telethon.client.users')
+telethon_log.setLevel(min(telethon_log.getEffectiveLevel(), logging.INFO))
+telethon_log.addHandler(FloodWaitLog())
+
+
+class ReportedError(Exception):
+    """Задача упала, и пользователю об этом уже написали"""
 
 
-def compress_audio(input_path, output_path):
-    """Сжатие аудио файла до приемлемого размера"""
+def job_settings(chat_id, record=None):
+    """Модель и VAD задачи. У записанной в журнал задачи они сохранены в source:
+    после перезапуска настройки бота сбрасываются, а хвост записи должен
+    распознаваться той же моделью, что и начало"""
+    if record is not None and 'model' in record.source:
+        return record.source['model'], record.source['vad']
+    return conf.current_model, conf.chat(chat_id)['vad']
+
+
+def job_source(chat_id, **source):
+    """source для журнала вместе с моделью и VAD, с которыми задачу приняли"""
+    model_name, vad = job_settings(chat_id)
+    return {**source, 'model': model_name, 'vad': vad}
+
+
+def finish_record(job):
+    if job.record is not None:
+        JOURNAL.finish(job.record)
+
+
+async def enqueue(chat_id, title, run, source=None, record=None):
+    """Ставит задачу в очередь и сообщает пользователю позицию.
+
+    Задачи с source (откуда заново взять файл) пишутся в журнал и
+    возобновляются после перезапуска, record — уже существующая запись.
+    """
+    async def run_in_workspace(job):
+        # все файлы задачи живут в ее папке и удаляются вместе с ней
+        try:
+            with STAGE_SECONDS.time(stage='job'), WORKSPACES.create(job.id) as job.workspace:
+                await run(job)
+        except asyncio.CancelledError:
+            JOBS.inc(state='cancelled')
+            # при остановке бота задача останется в журнале, при /cancel — нет
+            if job.state == 'cancelled':
+                finish_record(job)
+            raise
+        except Exception:
+            # в том числе ReportedError: пользователь уже знает, задача упала
+            JOBS.inc(state='failed')
+            finish_record(job)
+            raise
+        else:
+            JOBS.inc(state='done')
+            finish_record(job)
+
+    status_msg = await bot.send_message(chat_id, "🕐 Ставлю в очередь...")
+    job = Job(chat_id, title, run_in_workspace)
+    job.status_msg = status_msg.id
+    if record is None and source is not None:
+        record = JOURNAL.add(chat_id, title, source)
+    job.record = record
     try:
-        command = [
-            'ffmpeg', '-i', input_path,
-            '-acodec', 'libopus',
-            '-b:a', '32k',
-            '-ac', '1',
-            '-y',
-            output_path
-        ]
-        result = subprocess.run(command, capture_output=True, text=True, timeout=600)
-        if result.returncode != 0:
-            raise Exception(f"Ошибка сжатия аудио: {result.stderr}")
-        return True
-    except subprocess.TimeoutExpired:
-        raise Exception("Таймаут сжатия аудио")
-    except Exception as e:
-        raise Exception(f"Ошибка при сжатии аудио: {str(e)}")
+        position = scheduler.submit(job)
+    except QueueFull as e:
+        finish_record(job)
+        await bot.edit_message(chat_id, status_msg.id, f"⚠️ {e}")
+        return None
+    text = f"🕐 Задача #{job.id} в очереди, позиция {position}"
+    if not startup.ready.is_set():
+        text += "\n⏳ Бот только что запустился, модель еще загружается"
+    elif startup.warning():
+        text += "\n" + startup.warning()
+    await bot.edit_message(chat_id, status_msg.id, text)
+    return job
+
+
+parallel_transcribers = {}  # имя модели -> ParallelTranscriber
+parallel_lock = threading.Lock()
+
+
+def get_parallel_transcriber(model_name):
+    """Пул процессов для длинных записей, один на модель. Пулы других моделей
+    закрываются, если ими никто не пользуется"""
+    with parallel_lock:
+        for name, transcriber in list(parallel_transcribers.items()):
+            if name != model_name and not transcriber.active:
+                transcriber.shutdown()
+                MODELS.release(name, transcriber.model)
+                del parallel_transcribers[name]
+        transcriber = parallel_transcribers.get(model_name)
+        if transcriber is None:
+            from parallel import ParallelTranscriber
+            transcriber = ParallelTranscriber(MODELS.acquire(model_name), PARALLEL_WORKERS)
+            parallel_transcribers[model_name] = transcriber
+        transcriber.active += 1
+        return transcriber
 
 
-async def process_transcription(audio_path, chat_id, filename="unknown"):
-    """Обработка транскрипции аудио файла"""
+def transcribe_pcm(model_name, audio, timeline=None, offset=0.0):
+    """Транскрипция в потоке инференса. Если аудио прошло через VAD,
+    таймстемпы возвращаются к исходной записи по timeline. Если это хвост
+    записи с секунды offset (возобновленная задача), сдвигаются на offset"""
+    events = run_model(model_name, audio)
+    if timeline is not None:
+        events = remap_events(events, timeline)
+    if offset:
+        events = shift_events(events, offset)
+    return (yield from events)
+
+
+def run_model(model_name, audio):
+    """Транскрипция на свободной реплике модели, батчем для коротких записей
+    или пулом процессов для длинных"""
+    _, backend = parse_model_key(model_name)
+    if BATCHER is not None and backend.key != 'ct2' and fits(audio):
+        return (yield from BATCHER.transcribe_iter(model_name, audio))
+
+    # пул процессов делит веса через share_memory, это умеет только обычный whisper
+    if PARALLEL_WORKERS > 1 and backend.key == 'fp32' and not hasattr(audio, 'wait') \
+            and len(audio) > LONG_AUDIO_SECONDS * SAMPLE_RATE:
+        transcriber = get_parallel_transcriber(model_name)
+        try:
+            return (yield from transcriber.transcribe_iter(audio))
+        finally:
+            with parallel_lock:
+                transcriber.active -= 1
+
+    if backend.key == 'ct2' and hasattr(audio, 'wait'):
+        # faster-whisper принимает только готовый массив: ждем конца скачивания,
+        # пока реплика модели еще свободна
+        audio = audio.complete()
+    with MODELS.use(model_name) as model:
+        return (yield from backend.transcribe_iter(model, audio))
+
+
+class ResultOutput:
+    """Отправка результата в формате, выбранном в чате.
+
+    Текст отправляется сообщениями по 4095 символов прямо по ходу
+    распознавания. Если сообщений набирается больше MAX_TEXT_MESSAGES,
+    остальное не шлется по частям, а весь текст приходит в конце одним
+    файлом. Субтитры и JSON всегда присылаются файлом. Документ пишется
+    по мере поступления сегментов, в папку задачи или в память.
+    """
+
+    def __init__(self, chat_id, filename, directory=None):
+        fmt = conf.chat(chat_id)['format']
+        self.chat_id = chat_id
+        self.document = Document(fmt, os.path.splitext(filename)[0] or 'transcript', directory)
+        self.inline = fmt == 'txt'
+        self.unsent = ""
+        self.messages = 0
+        self.first_msg = None
+
+    async def _send(self, text):
+        message = await bot.send_message(self.chat_id, text)
+        self.messages += 1
+        self.first_msg = self.first_msg or message.id
+
+    async def add(self, segment):
+        chunk = self.document.add(segment)
+        if not self.inline:
+            return
+        self.unsent += chunk
+        while len(self.unsent) > 4095:
+            if self.messages >= MAX_TEXT_MESSAGES:
+                self.inline = False  # дальше — одним файлом
+                return
+            await self._send(self.unsent[:4095])
+            self.unsent = self.unsent[4095:]
+
+    async def finish(self, header, language):
+        self.document.close(language)
+        if self.inline:
+            # Отправляем остаток текста
+            if self.unsent.strip():
+                await self._send(self.unsent)
+            await bot.send_message(self.chat_id, header, reply_to=self.first_msg)
+        else:
+            await bot.send_file(self.chat_id, self.document.upload(), caption=header,
+                                reply_to=self.first_msg, force_document=True)
+
+
+async def send_cached_result(chat_id, cached, model_name, filename):
+    """Отправляет результат из кэша без скачивания и инференса"""
+    output = ResultOutput(chat_id, filename)
+    for start, end, text in cached.segments:
+        await output.add(Segment(start, end, text))
+    await output.finish(f"#result #cached #{model_tag(model_name)} {filename}", cached.language)
+
+
+async def process_transcription(audio_path, chat_id, filename="unknown", doc_id=None, pcm=None, record=None):
+    """Обработка транскрипции аудио файла.
+
+    Если передан pcm (ingest.PCMStream), файл еще скачивается в audio_path,
+    а распознавание идет по мере декодирования. Сегменты пишутся в запись
+    журнала record; если в ней уже есть сегменты, распознается только хвост.
+    """
+    model_name, vad = job_settings(chat_id, record)
+    resume_at = record.resume_at if record is not None else 0.0
+    loop = asyncio.get_running_loop()
+    sha256 = None
+    mmap_path = None
+    spill = None
     try:
-        # Проверяем размер файла
-        file_size = os.path.getsize(audio_path)
-        max_size = 50 * 1024 * 1024  # 50 MB
+        if pcm is None:
+            # Тот же файл могли уже распознавать, например переслали заново
+            sha256 = await loop.run_in_executor(None, file_sha256, audio_path)
+            cached = await loop.run_in_executor(None, RESULTS.get_by_hash, sha256, model_name, vad)
+            if cached is not None:
+                await send_cached_result(chat_id, cached, model_name, filename)
+                return
 
-        if file_size > max_size:
-            await bot.send_message(chat_id, "⚠️ Файл слишком большой. Пытаюсь сжать...")
-            compressed_path = join(dirname, 'compressed_audio.ogg')
-            compress_audio(audio_path, compressed_path)
-            audio_path = compressed_path
+            # Заранее перекодировать файл не нужно: ffmpeg сам достает звук из любого
+            # контейнера. ffprobe проверяет, что звук есть, и по длительности решает,
+            # держать PCM в памяти или в файле на диске
+            with STAGE_SECONDS.time(stage='probe'):
+                info = await probe(audio_path)
+            WORKSPACES.reserve(os.path.dirname(audio_path), int(info.duration * DOCUMENT_BYTES_PER_SECOND))
+            if info.pcm_bytes > PCM_IN_MEMORY_MB * 1024 * 1024:
+                spill = SPILL.create('pcm')
+                try:
+                    spill.reserve(info.pcm_bytes)
+                    mmap_path = spill.path('audio.pcm')
+                except QuotaExceeded:
+                    pass  # места на диске нет — декодируем в память
 
         status_msg = await bot.send_message(chat_id, "Начало транскрипции...")
+        if record is not None:
+            JOURNAL.stage(record, 'transcribing')
+
+        if pcm is None:
+            # Один процесс ffmpeg достает звук из любого контейнера сразу в PCM,
+            # видео не декодируется и промежуточных файлов нет
+            with STAGE_SECONDS.time(stage='decode'):
+                audio = await decode_audio(audio_path, mmap_path)
+        else:
+            audio = pcm
+        if resume_at:
+            # начало уже распознано до перезапуска
+            audio = audio[int(resume_at * SAMPLE_RATE):]
 
         async def update_segment(text):
-            try:
-                await bot.edit_message(chat_id, status_msg.id, text)
-            except Exception as e:
-                print(f"Ошибка при обновлении сообщения: {e}")
+            await bot.edit_message(chat_id, status_msg.id, text)
 
-        gen = MODEL.transcribe(audio_path, verbose=False)
-        final_text = ""
-        
-        while True:
-            try:
-                i = next(gen)
-            except StopIteration as e:
-                i = e.value
-            if isinstance(i, str):
-                await update_segment(i)
-            else:
-                final_text = i['text']
-                break
+        # Тишину и музыку выкидываем до модели, если в чате включен /vad
+        timeline = None
+        if pcm is None and vad:
+            with STAGE_SECONDS.time(stage='vad'):
+                audio, timeline = await loop.run_in_executor(None, apply_vad, audio)
+            await update_segment(f"🔇 Пропущено {timeline.skipped:.0f} с тишины из {timeline.total:.0f} с")
+
+        # Инференс идет в отдельном потоке, сегменты и прогресс приходят через очередь,
+        # а статус обновляется не чаще раза в PROGRESS_INTERVAL секунд.
+        # Результат собирается по мере поступления сегментов, см. ResultOutput
+        output = ResultOutput(chat_id, filename, os.path.dirname(audio_path))
+        for segment in record.segments if resume_at else []:
+            await output.add(segment)
+        transcript = None
+        started = time.perf_counter()
+        async with ProgressReporter(update_segment, interval=PROGRESS_INTERVAL) as progress:
+            async for event in iterate_in_executor(transcribe_pcm, model_name, audio, timeline, resume_at):
+                if isinstance(event, Segment):
+                    if record is not None:
+                        JOURNAL.add_segment(record, event)
+                    progress.update(text=event.text)
+                    await output.add(event)
+                elif isinstance(event, Progress):
+                    progress.update(event.percent, f"⏳ {event.percent:.1f}%; "
+                                                   f"{event.done:.0f} из {event.total:.0f} с")
+                elif isinstance(event, Transcript):
+                    transcript = event
+                    startup.error = None  # модель все-таки загрузилась
+                    if resume_at:
+                        transcript = Transcript(record.segments + event.segments, event.language)
+                    print(f"Транскрипция {filename}: {len(event.segments)} сегментов, язык {event.language}")
+        FLOOD_WAITS.inc(progress.flood_waits)
+
+        # для потока длина известна только теперь, после VAD считаем по исходной записи
+        elapsed = time.perf_counter() - started
+        seconds = timeline.total if timeline is not None else len(audio) / SAMPLE_RATE
+        STAGE_SECONDS.observe(elapsed, stage='inference')
+        AUDIO_SECONDS.inc(seconds)
+        if seconds:
+            REALTIME_FACTOR.observe(elapsed / seconds, model=model_name)
+
+        if sha256 is None:
+            # файл докачался вместе с декодированием, теперь можно посчитать хэш
+            sha256 = await loop.run_in_executor(None, file_sha256, audio_path)
+        RESULTS.put(sha256, model_name, transcript.text,
+                    [(s.start, s.end, s.text) for s in transcript.segments], doc_id, vad=timeline is not None)
 
         try:
-            await bot.delete_messages(chat_id, status_msg.id)
-            
-            # Отправляем заголовок с тегами
-            first_msg=None
-            # Отправляем текст частями, если он слишком длинный
-            for x in range(0, len(final_text), 4095):
-                message = await bot.send_message(chat_id, final_text[x:x + 4095])
-                if x==0:
-                    first_msg = message.id
-
-            header = f"#result #{conf.current_model} {filename}"
-            await bot.send_message(chat_id, header, reply_to=first_msg)
+            with STAGE_SECONDS.time(stage='send'):
+                await bot.delete_messages(chat_id, status_msg.id)
+
+                header = f"#result #{model_tag(model_name)} {filename}"
+                if timeline is not None:
+                    header += f"\n🔇 VAD: пропущено {timeline.skipped:.0f} с тишины"
+                await output.finish(header, transcript.language)
             
         except Exception as e:
             print(f"Ошибка при отправке финального текста: {e}")
 
     except Exception as e:
+        ERRORS.inc(stage='transcription')
         error_msg = f"❌ Ошибка при транскрипции:\n<code>{h.escape(str(e))}</code>"
         await bot.send_message(chat_id, error_msg, parse_mode='html')
         traceback_msg = f"<code>{h.escape(traceback.format_exc())}</code>"
         for x in range(0, len(traceback_msg), 4095):
             message = await bot.send_message(chat_id, traceback_msg[x:x + 4095], parse_mode='html')
-           
+        # задача должна считаться упавшей, а не выполненной
+        raise ReportedError(str(e)) from e
     finally:
-        # Очистка временных файлов
-        try:
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-        except:
-            pass
+        if spill is not None:
+            spill.close()
 
 
-@bot.on(events.NewMessage(pattern='/start'))
 async def start_handler(event):
     """Обработчик команды /start"""
-    sender = await event.get_sender()
-    if sender.username not in ALLOWED_USERNAMES:
-        return
-    
     conf.chat_id = event.chat_id
     await event.respond("Бот активирован. Отправьте голосовое, аудио или видеосообщение для транскрипции.")
+    if not startup.ready.is_set():
+        await event.respond("⏳ Модель еще загружается, присланные файлы встанут в очередь")
+    elif startup.warning():
+        await event.respond(startup.warning())
     await event.respond(send_help_text().format(conf.current_model), parse_mode='html')
 
 
-@bot.on(events.NewMessage(pattern='/help'))
 async def help_handler(event):
     """Обработчик команды /help"""
-    sender = await event.get_sender()
-    if sender.username not in ALLOWED_USERNAMES:
-        return
-    
     conf.chat_id = event.chat_id
     await event.respond(send_help_text().format(conf.current_model), parse_mode='html')
 
 
-@bot.on(events.NewMessage(pattern='/model'))
 async def model_handler(event):
     """Обработчик команды /model"""
-    sender = await event.get_sender()
-    if sender.username not in ALLOWED_USERNAMES:
-        return
-    
     conf.chat_id = event.chat_id
     
-    # Создаем кнопки для выбора модели
+    # Создаем кнопки для выбора модели: строка на модель, кнопка на бэкенд
+    backends = available_backends()
     buttons = []
     for model_name in WHISPER_MODELS:
-        buttons.append([Button.inline(model_name, f"set_model_{model_name}")])
+        row = []
+        for backend in backends:
+            label = model_name if backend.key == 'fp32' else f"{model_name} {backend.title}"
+            row.append(Button.inline(label, f"set_model_{model_key(model_name, backend.key)}"))
+        buttons.append(row)
+
+    lines = ["Выберите модель для транскрипции:",
+             "int8 — квантованная модель: в 2-3 раза меньше памяти и быстрее на CPU"]
+    resident = MODELS.stats()
+    if resident:
+        lines.append("\nВ памяти:")
+        for info in resident:
+            lines.append(f"- {info['name']}: {info['replicas']} шт. по {info['size_mb'] or 0:.0f} МБ, "
+                         f"загрузка {info['load_time'] or 0:.1f} с")
+    if MODELS.budget_mb:
+        lines.append(f"Бюджет памяти: {MODELS.budget_mb} МБ")
     
-    await event.respond("Выберите модель для транскрипции:", buttons=buttons)
+    await event.respond("\n".join(lines), buttons=buttons)
+
+
+async def queue_handler(event):
+    """Обработчик команды /queue"""
+    running = scheduler.running()
+    pending = scheduler.pending()
+    if not running and not pending:
+        await event.respond("Очередь пуста")
+        return
+
+    lines = [f"<b>Воркеров:</b> {scheduler.workers}, <b>в очереди:</b> {len(pending)}/{scheduler.max_queue}"]
+    for job in running:
+        lines.append(f"▶️ {h.escape(job.describe())}")
+    for n, job in enumerate(pending, start=1):
+        lines.append(f"{n}. {h.escape(job.describe())}")
+    await event.respond("\n".join(lines), parse_mode='html')
+
+
+async def cancel_handler(event):
+    """Обработчик команды /cancel"""
+    # /cancel — отменить все задачи чата, /cancel 12 — только задачу #12
+    args = event.message.text.split()[1:]
+    job_id = None
+    if args:
+        try:
+            job_id = int(args[0].lstrip('#'))
+        except ValueError:
+            await event.respond("Использование: /cancel [номер задачи]")
+            return
+
+    cancelled = scheduler.cancel(event.chat_id, job_id)
+    if not cancelled:
+        await event.respond("Нечего отменять")
+        return
+    for job in cancelled:
+        finish_record(job)
+        try:
+            await bot.edit_message(job.chat_id, job.status_msg, f"🚫 Задача #{job.id} отменена")
+        except Exception as e:
+            print(f"Ошибка при обновлении сообщения: {e}")
+    await event.respond(f"Отменено задач: {len(cancelled)}")
+
+
+async def vad_handler(event):
+    """Обработчик команды /vad"""
+    chat = conf.chat(event.chat_id)
+    chat['vad'] = not chat['vad']
+    if chat['vad']:
+        await event.respond("🔇 Пропуск тишины включен: модель получит только участки с речью")
+    else:
+        await event.respond("🔊 Пропуск тишины выключен")
+
+
+async def format_handler(event):
+    """Обработчик команды /format"""
+    # /format srt — сразу выбрать формат, /format — показать кнопки
+    args = event.message.text.split()[1:]
+    if args:
+        await set_format(event.chat_id, args[0].lower(), event.respond)
+        return
+    current = conf.chat(event.chat_id)['format']
+    buttons = [[Button.inline(f"{'✅ ' if fmt == current else ''}{title}", f"set_format_{fmt}")]
+               for fmt, title in FORMATS.items()]
+    await event.respond("Выберите формат результата:", buttons=buttons)
+
+
+async def set_format(chat_id, fmt, respond):
+    if fmt not in FORMATS:
+        await respond(f"Неизвестный формат, доступны: {', '.join(FORMATS)}")
+        return
+    conf.chat(chat_id)['format'] = fmt
+    if fmt == 'txt':
+        await respond(f"✅ Результат будет приходить текстом, длиннее {MAX_TEXT_MESSAGES} сообщений — файлом")
+    else:
+        await respond(f"✅ Результат будет приходить файлом: {FORMATS[fmt]}")
+
+
+async def set_format_callback(event):
+    """Обработчик выбора формата"""
+    await event.answer()
+    await set_format(event.chat_id, event.data.decode('utf-8').replace('set_format_', ''),
+                     lambda text: bot.send_message(event.chat_id, text))
+
+
+async def stats_handler(event):
+    """Обработчик команды /stats"""
+    uptime = int(time.time() - metrics.STARTED)
+    lookups = RESULTS.hits + RESULTS.misses
+    lines = [
+        f"<b>Работает:</b> {uptime // 3600} ч {uptime % 3600 // 60} мин",
+        f"<b>Задачи:</b> выполнено {JOBS.value(state='done')}, с ошибкой {JOBS.value(state='failed')}, "
+        f"отменено {JOBS.value(state='cancelled')}",
+        f"<b>Очередь:</b> {len(scheduler.pending())}, выполняется {len(scheduler.running())}",
+        f"<b>Кэш:</b> {RESULTS.hits} из {lookups} попаданий" if lookups else "<b>Кэш:</b> обращений не было",
+        f"<b>Распознано аудио:</b> {AUDIO_SECONDS.value() / 60:.1f} мин",
+        f"<b>Ошибок:</b> {ERRORS.total()}, <b>FloodWait:</b> {FLOOD_WAITS.value()}",
+    ]
+    if MODELS.budget_mb:
+        lines.append(f"<b>Модели в памяти:</b> {MODELS.resident_mb():.0f} из {MODELS.budget_mb} МБ")
+
+    def table(title, histogram):
+        rows = sorted(histogram.summary().items())
+        if rows:
+            lines.append(f"\n<b>{title}</b> (медиана / 95%, число):")
+            for key, (count, p50, p95) in rows:
+                label = ", ".join(str(v) for _, v in key)
+                lines.append(f"{h.escape(label)}: {p50:.2f} / {p95:.2f}, {count}")
+
+    table("Этапы, с", STAGE_SECONDS)
+    table("RTF по моделям", REALTIME_FACTOR)
+    table("Загрузка моделей, с", MODEL_LOAD_SECONDS)
+    await event.respond("\n".join(lines), parse_mode='html')
 
 
-@bot.on(events.CallbackQuery(pattern=b'set_model_'))
 async def set_model_callback(event):
     """Обработчик выбора модели"""
     model_name = event.data.decode('utf-8').replace('set_model_', '')
-    
-    if model_name in WHISPER_MODELS:
-        global MODEL
-        MODEL = whisper.load_model(model_name).to('cpu')
+    name, _, backend = model_name.partition(':')
+
+    if name in WHISPER_MODELS and (not backend or backend in BACKENDS and BACKENDS[backend].available()):
+        await event.answer("Загружаю модель...")
+        # Загрузка весов идет в фоне, пока она не закончится, задачи
+        # обслуживает текущая модель
+        loop = asyncio.get_running_loop()
+        try:
+            load_time = await loop.run_in_executor(None, MODELS.preload, model_name)
+        except MemoryError as e:
+            await bot.send_message(event.chat_id, f"⚠️ {e}")
+            return
         conf.current_model = model_name
-        await event.answer()
+        if load_time is None:
+            details = "уже была в памяти"
+        else:
+            details = f"загружена за {load_time:.1f} с"
         await bot.send_message(event.chat_id, 
-                               f"✅ Модель успешно изменена на <b>{model_name}</b>", 
+                               f"✅ Модель успешно изменена на <b>{model_name}</b> ({details})", 
                                parse_mode='html')
     else:
         await event.answer("Неизвестная модель", alert=True)
 
 
-@bot.on(events.NewMessage)
 async def voice_and_audio_handler(event):
     """Обработчик голосовых сообщений, аудио и видеозаметок"""
-    global message_lock
-    sender = await event.get_sender()
-    if sender.username not in ALLOWED_USERNAMES:
-        return
-    
-    # Проверяем, обрабатывается ли уже сообщение
-    async with message_lock:
-    
-        conf.chat_id = event.chat_id
+    conf.chat_id = chat_id = event.chat_id
+    message = event.message
+
+    try:
+        # Проверяем, есть ли медиа в сообщении
+        if not message.media:
+            return
         
-        try:
-            # Проверяем, есть ли медиа в сообщении
-            if not event.message.media:
-                return
+        filename = "voice_message"
+        audio_filename = None
+        doc_id = None
+
+        if hasattr(message.media, 'document'):
+            document = message.media.document
+            doc_id = document.id
+
+            # Проверяем атрибуты документа
+            is_video_note = False
+            is_audio = False
             
-            filename = "voice_message"
+            for attr in document.attributes:
+                if isinstance(attr, DocumentAttributeVideo) and attr.round_message:
+                    is_video_note = True
+                    break
+                if isinstance(attr, DocumentAttributeAudio) and not attr.voice:
+                    is_audio = True
+                    if hasattr(attr, 'title') and attr.title:
+                        audio_filename = attr.title
+                    elif hasattr(attr, 'performer') and attr.performer:
+                        audio_filename = attr.performer
+
+                    for attr in document.attributes:
+                        if hasattr(attr, 'file_name'):
+                            audio_filename = attr.file_name
+                            print(f"Received media with filename: {audio_filename}")
+                            break
+                    else:
+                        print("nf")
+        
+        # Обработка голосовых сообщений
+        if hasattr(message.media, 'voice') or \
+        (hasattr(message, 'voice') and message.voice):
+            filename = audio_filename or "voice_message.ogg"
+            await enqueue_telegram(message, chat_id, filename, 'voice.ogg', doc_id, "голосовое сообщение")
+            return
+        
+        # Обработка видеозаметок (кружков)
+        
+        if hasattr(message.media, 'document'):
 
-            if hasattr(event.message.media, 'document'):
-                document = event.message.media.document
-                
-                # Проверяем атрибуты документа
-                is_video_note = False
-                is_audio = False
-                audio_filename = None
-                
-                for attr in document.attributes:
-                    if isinstance(attr, DocumentAttributeVideo) and attr.round_message:
-                        is_video_note = True
-                        break
-                    if isinstance(attr, DocumentAttributeAudio) and not attr.voice:
-                        is_audio = True
-                        if hasattr(attr, 'title') and attr.title:
-                            audio_filename = attr.title
-                        elif hasattr(attr, 'performer') and attr.performer:
-                            audio_filename = attr.performer
-
-                        for attr in document.attributes:
-                            if hasattr(attr, 'file_name'):
-                                audio_filename = attr.file_name
-                                print(f"Received media with filename: {audio_filename}")
-                                break
-                        else:
-                            print("nf")
             
-            # Обработка голосовых сообщений
-            if hasattr(event.message.media, 'voice') or \
-            (hasattr(event.message, 'voice') and event.message.voice):
-                await bot.send_message(conf.chat_id, "⏬ Скачиваю голосовое сообщение...")
-                audio_path = join(dirname, 'to_transcribe.ogg')
-                await bot.download_media(event.message, audio_path)
-                filename =  audio_filename or "voice_message.ogg"
-                await process_transcription(audio_path, conf.chat_id, filename)
+            # Обработка видеозаметок
+            if is_video_note:
+                file_size = document.size
+                if file_size > TELEGRAM_MAX_MB * 1024 * 1024:
+                    await bot.send_message(chat_id, 
+                                        f"⚠️ Файл больше {TELEGRAM_MAX_MB} МБ. Пожалуйста, пришлите прямую ссылку на файл.")
+                    return
+                
+                # звук из видео достает ffmpeg при декодировании
+                filename = "video_note.mp4"
+                await enqueue_telegram(message, chat_id, filename, 'video_note.mp4', doc_id, "видеосообщение")
                 return
             
-            # Обработка видеозаметок (кружков)
-            
-            if hasattr(event.message.media, 'document'):
-   
+            # Обработка аудио файлов (mp3, ogg, wav и т.д.)
+            if is_audio:
+                file_size = document.size
                 
-                # Обработка видеозаметок
-                if is_video_note:
-                    file_size = document.size
-                    if file_size > 20 * 1024 * 1024:
-                        await bot.send_message(conf.chat_id, 
-                                            "⚠️ Файл слишком большой. Пожалуйста, пришлите прямую ссылку на файл.")
-                        return
-                    
-                    await bot.send_message(conf.chat_id, "⏬ Скачиваю видеосообщение...")
-                    video_path = join(dirname, 'video_note.mp4')
-                    await bot.download_media(event.message, video_path)
-                    
-                    await bot.send_message(conf.chat_id, "🎥 Извлекаю аудио из видео...")
-                    clip = mp.VideoFileClip(video_path)
-                    audio_path = join(dirname, "to_transcribe.ogg")
-                    clip.audio.write_audiofile(audio_path)
-                    clip.close()
-                    
-                    os.remove(video_path)
-                    filename = "video_note.mp4"
-                    await process_transcription(audio_path, conf.chat_id, filename)
+                # Если файл слишком большой, просим прислать ссылку
+                if file_size > TELEGRAM_MAX_MB * 1024 * 1024:
+                    await bot.send_message(chat_id, 
+                                        f"⚠️ Файл больше {TELEGRAM_MAX_MB} МБ, через Telegram его не скачать. "
+                                        "Пожалуйста, пришлите прямую ссылку на файл.")
                     return
                 
-                # Обработка аудио файлов (mp3, ogg, wav и т.д.)
-                if is_audio:
-                    file_size = document.size
-                    
-                    # Если файл слишком большой, просим прислать ссылку
-                    if file_size > 20 * 1024 * 1024:
-                        await bot.send_message(conf.chat_id, 
-                                            "⚠️ Файл слишком большой для скачивания через Telegram. "
-                                            "Пожалуйста, пришлите прямую ссылку на файл.")
-                        return
-                    
-                    await bot.send_message(conf.chat_id, "⏬ Скачиваю аудио файл...")
-                    
-                    # Получаем расширение файла
-                    mime_type = document.mime_type or 'audio/ogg'
-                    ext = mime_type.split('/')[-1]
-                    if ext == 'mpeg':
-                        ext = 'mp3'
-                    # Используем имя файла из атрибутов, если есть
-                    if not audio_filename:
-                        audio_filename = f"audio_file.{ext}"
-                    elif not audio_filename.endswith(f'.{ext}'):
-                        audio_filename = f"{audio_filename}.{ext}"
-                    
-                    audio_path = join(dirname, f'to_transcribe.{ext}')
-                    await bot.download_media(event.message, audio_path)
-                    filename = audio_filename
-                    await process_transcription(audio_path, conf.chat_id, filename)
+                # Получаем расширение файла
+                mime_type = document.mime_type or 'audio/ogg'
+                ext = mime_type.split('/')[-1]
+                if ext == 'mpeg':
+                    ext = 'mp3'
+                # Используем имя файла из атрибутов, если есть
+                if not audio_filename:
+                    audio_filename = f"audio_file.{ext}"
+                elif not audio_filename.endswith(f'.{ext}'):
+                    audio_filename = f"{audio_filename}.{ext}"
+                filename = audio_filename
+                await enqueue_telegram(message, chat_id, filename, f'audio.{ext}', doc_id, "аудио файл")
+                return
+    
+    except Exception as e:
+        await send_media_error(chat_id, e)
+
+
+async def send_media_error(chat_id, e):
+    ERRORS.inc(stage='media')
+    error_msg = f"❌ Ошибка обработки медиа:\n<code>{h.escape(str(e))}</code>"
+    await bot.send_message(chat_id, error_msg, parse_mode='html')
+    traceback_msg = f"<code>{h.escape(traceback.format_exc())}</code>"
+    for x in range(0, len(traceback_msg), 4095):
+        await bot.send_message(chat_id, traceback_msg[x:x + 4095], parse_mode='html')
+
+
+async def stream_transcription(decoder, fetch, audio_path, chat_id, filename, doc_id=None, record=None):
+    """Распознает файл по мере скачивания.
+
+    fetch(sink) качает файл в audio_path и отдает байты по порядку в sink,
+    они сразу идут в запущенный decoder (ingest.StreamDecoder).
+    """
+    async def feed():
+        try:
+            await fetch(decoder.feed)
+        except BaseException as e:
+            # ошибку увидит распознавание, ожидающее данных
+            await decoder.close(e if isinstance(e, Exception) else Exception("Скачивание прервано"))
+            raise
+        await decoder.close()
+
+    feed_task = asyncio.create_task(feed())
+    try:
+        await process_transcription(audio_path, chat_id, filename, doc_id, pcm=decoder.pcm, record=record)
+    finally:
+        feed_task.cancel()
+        await asyncio.gather(feed_task, return_exceptions=True)
+
+
+async def transcribe_telegram_media(message, path, chat_id, filename, doc_id, what, record=None):
+    """Качает медиа из Telegram несколькими параллельными запросами и распознает.
+
+    Потоковые форматы (голосовые, mp3 и т.п.) распознаются прямо во время
+    скачивания, остальные — после. Короткие записи и возобновленная задача
+    (ее распознавание начинается с середины записи) качаются целиком.
+    """
+    size = message.file.size
+    duration = message.file.duration
+    status_msg = await bot.send_message(chat_id, f"⏬ Скачиваю {what}...")
+
+    async def update_status(text):
+        await bot.edit_message(chat_id, status_msg.id, text)
+
+    async with ProgressReporter(update_status, interval=PROGRESS_INTERVAL) as progress:
+        def on_progress(done, total):
+            mb = 1024 * 1024
+            progress.update(done / total * 100, f"⏬ Скачано {done / mb:.1f} из {total / mb:.1f} МБ")
+
+        async def fetch(sink=None):
+            with STAGE_SECONDS.time(stage='download'):
+                if size:
+                    await download_media(bot, message.media, size, path, on_progress, sink)
                     return
-        
+                # размер неизвестен — качаем как есть, одним потоком
+                await bot.download_media(message, path)
+                if sink is not None:
+                    with open(path, 'rb') as f:
+                        await sink(f.read())
+
+        resumed = record is not None and record.resume_at
+        long = duration > MAX_CLIP_SECONDS if duration else (size or 0) > STREAM_MIN_BYTES
+        _, vad = job_settings(chat_id, record)
+        if path.lower().endswith(STREAMABLE_EXTENSIONS) and long and not vad and not resumed:
+            decoder = await StreamDecoder(size).start()
+            await stream_transcription(decoder, fetch, path, chat_id, filename, doc_id, record)
+        else:
+            await fetch()
+            await process_transcription(path, chat_id, filename, doc_id, record=record)
+
+
+def media_job(run):
+    """Оборачивает задачу обработки медиа, чтобы ошибки доходили до пользователя"""
+    async def wrapped(job):
+        try:
+            await run(job)
+        except ReportedError:
+            raise
         except Exception as e:
-            error_msg = f"❌ Ошибка обработки медиа:\n<code>{h.escape(str(e))}</code>"
-            await bot.send_message(conf.chat_id, error_msg, parse_mode='html')
-            traceback_msg = f"<code>{h.escape(traceback.format_exc())}</code>"
-            for x in range(0, len(traceback_msg), 4095):
-                await bot.send_message(conf.chat_id, traceback_msg[x:x + 4095], parse_mode='html')
-      
+            await send_media_error(job.chat_id, e)
+            raise ReportedError(str(e)) from e
+    return wrapped
 
 
-@bot.on(events.NewMessage)
-async def url_handler(event):
-    """Обработка прямых ссылок на файлы"""
-    global message_lock
-    sender = await event.get_sender()
-    if sender.username not in ALLOWED_USERNAMES:
-        return
-    
-    text = event.message.text
-    if not text or not (text.startswith('http://') or text.startswith('https://')):
+def telegram_job(message, chat_id, filename, name, doc_id, what):
+    """Задача: скачать медиа сообщения в файл name в папке задачи и распознать"""
+    async def run(job):
+        job.workspace.reserve(message.file.size or 0)
+        await transcribe_telegram_media(message, job.workspace.path(name), chat_id, filename, doc_id, what,
+                                        job.record)
+    return media_job(run)
+
+
+async def enqueue_telegram(message, chat_id, filename, name, doc_id, what):
+    """Ставит в очередь медиа из сообщения, запомнив в журнале, как его найти заново.
+
+    Пересланный файл, который уже распознавали, в очередь не попадает:
+    результат сразу берется из кэша. Проверяем только здесь, когда уже ясно,
+    что это звук, а не стикер или PDF, иначе они портят долю попаданий в /stats
+    """
+    model_name, vad = job_settings(chat_id)
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(None, RESULTS.get_by_document, doc_id, model_name, vad)
+    if cached is not None:
+        await send_cached_result(chat_id, cached, model_name, message.file.name or "cached")
         return
-    
-    # Проверяем, обрабатывается ли уже сообщение
-    async with message_lock:
-    
+    source = job_source(chat_id, kind='telegram', message_id=message.id, name=name, doc_id=doc_id, what=what)
+    await enqueue(chat_id, filename, telegram_job(message, chat_id, filename, name, doc_id, what), source)
+
+
+def url_job(chat_id, url, filename):
+    """Задача: скачать файл по ссылке в папку задачи и распознать"""
+    async def run(job):
         try:
-            conf.chat_id = event.chat_id
-            url = text.strip()
+            status_msg = await bot.send_message(chat_id, "⏬ Скачиваю файл по ссылке...")
             
-            # Извлекаем имя файла из URL
-            filename = url.split('/')[-1].split('?')[0] or "downloaded_file"
-            
-            await bot.send_message(conf.chat_id, "⏬ Скачиваю файл по ссылке...")
-            
-            # Создаем временный файл для скачивания
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.download') as temp_file:
-                download_path = temp_file.name
-            
-            # Скачиваем файл
-            download_large_file(url, download_path)
-            
-            # Определяем тип файла по расширению URL
-            url_lower = url.lower()
-            
-            # Проверяем тип файла и конвертируем если нужно
-            if any(url_lower.endswith(ext) for ext in ['.mp4', '.mov', '.avi', '.mkv', '.webm']):
-                # Это видео файл
-                await bot.send_message(conf.chat_id, "🎥 Извлекаю аудио из видео...")
-                audio_path = join(dirname, "extracted_audio.ogg")
-                clip = mp.VideoFileClip(download_path)
-                clip.audio.write_audiofile(audio_path)
-                clip.close()
-                os.remove(download_path)
-            else:
-                # Это аудио файл
-                audio_path = download_path
-            
-            await process_transcription(audio_path, conf.chat_id, filename)
+            # Файл качается в папку задачи, места в ней не больше, чем осталось от квоты
+            download_path = job.workspace.path(f"download{os.path.splitext(filename)[1]}")
+            max_bytes = min(MAX_DOWNLOAD_MB * 1024 * 1024, WORKSPACES.available_bytes())
+
+            async def update_status(text):
+                await bot.edit_message(chat_id, status_msg.id, text)
+
+            async with ProgressReporter(update_status, interval=PROGRESS_INTERVAL) as progress:
+                decoder = None
+
+                reserved = False
+
+                def on_progress(done, total):
+                    nonlocal reserved
+                    mb = 1024 * 1024
+                    if total and not reserved:
+                        # размер стал известен — место под файл резервируем сразу целиком
+                        job.workspace.reserve(total)
+                        reserved = True
+                    if total:
+                        progress.update(done / total * 100, f"⏬ Скачано {done / mb:.1f} из {total / mb:.1f} МБ")
+                        if decoder is not None:
+                            decoder.total_bytes = total
+                    else:
+                        progress.update(status=f"⏬ Скачано {done / mb:.1f} МБ")
+
+                # Видео и аудио одинаково идут в ffmpeg, звук он достанет сам.
+                # Потоковые форматы декодируются и распознаются прямо во время скачивания,
+                # кроме возобновленной задачи: ее распознавание начинается с середины записи
+                streamable = filename.lower().endswith(STREAMABLE_EXTENSIONS)
+                resumed = job.record is not None and job.record.resume_at
+                _, vad = job_settings(chat_id, job.record)
+                if not streamable or vad or resumed:
+                    with STAGE_SECONDS.time(stage='download'):
+                        await download(url, download_path, max_bytes, on_progress)
+                    await process_transcription(download_path, chat_id, filename, record=job.record)
+                    return
+
+                decoder = await StreamDecoder().start()
+
+                async def fetch(sink):
+                    with STAGE_SECONDS.time(stage='download'):
+                        await download(url, download_path, max_bytes, on_progress, sink)
+
+                await stream_transcription(decoder, fetch, download_path, chat_id, filename, record=job.record)
             
+        except ReportedError:
+            raise
         except Exception as e:
+            ERRORS.inc(stage='url')
             error_msg = f"❌ Ошибка обработки ссылки:\n<code>{h.escape(str(e))}</code>"
-            await bot.send_message(conf.chat_id, error_msg, parse_mode='html')
-     
+            await bot.send_message(chat_id, error_msg, parse_mode='html')
+            raise ReportedError(str(e)) from e
+
+    return run
+
+
+async def url_handler(event):
+    """Обработка прямых ссылок на файлы"""
+    conf.chat_id = chat_id = event.chat_id
+    url = event.message.text.strip()
+    
+    # Извлекаем имя файла из URL
+    filename = url.split('/')[-1].split('?')[0] or "downloaded_file"
+
+    await enqueue(chat_id, filename, url_job(chat_id, url, filename), job_source(chat_id, kind='url', url=url))
+
+
+COMMANDS = {
+    '/start': start_handler,
+    '/help': help_handler,
+    '/model': model_handler,
+    '/queue': queue_handler,
+    '/cancel': cancel_handler,
+    '/vad': vad_handler,
+    '/format': format_handler,
+    '/stats': stats_handler,
+}
+
+CALLBACKS = {
+    b'set_model_': set_model_callback,
+    b'set_format_': set_format_callback,
+}
+
+
+def route(message):
+    """Обработчик для сообщения: команда, файл или ссылка. None — сообщение не для бота"""
+    text = message.text or ''
+    if text.startswith('/'):
+        # /model@имя_бота в группах — та же команда
+        return COMMANDS.get(text.split()[0].split('@')[0].lower())
+    if getattr(message.media, 'document', None) is not None:
+        return voice_and_audio_handler
+    if text.startswith(('http://', 'https://')):
+        return url_handler
+    return None
+
+
+async def message_router(event):
+    """Единая точка входа для сообщений: каждое разбирается один раз и идет
+    ровно в один обработчик, доступ проверяется только у нужных боту"""
+    handler = route(event.message)
+    if handler is None or not await ACCESS.allows(event):
+        return
+    await handler(event)
+
+
+async def callback_router(event):
+    """Единая точка входа для нажатий кнопок"""
+    for prefix, handler in CALLBACKS.items():
+        if event.data.startswith(prefix):
+            if not await ACCESS.allows(event):
+                await event.answer("Нет доступа", alert=True)
+                return
+            await handler(event)
+            return
+
+
+async def restore_job(record):
+    """Собирает задачу заново по источнику из журнала"""
+    source = record.source
+    if source['kind'] == 'url':
+        return url_job(record.chat_id, source['url'], record.title)
+    message = await bot.get_messages(record.chat_id, ids=source['message_id'])
+    if message is None or not message.media:
+        raise Exception("сообщение с файлом удалено")
+    return telegram_job(message, record.chat_id, record.title, source['name'], source['doc_id'], source['what'])
+
+
+async def resume_jobs():
+    """Ставит в очередь задачи, прерванные прошлым запуском бота"""
+    for record in JOURNAL.unfinished():
+        try:
+            if record.attempts >= MAX_RESUMES:
+                JOURNAL.finish(record)
+                await bot.send_message(record.chat_id, f"⚠️ Задача «{record.title}» прерывалась перезапуском "
+                                                       f"бота {record.attempts + 1} раз, больше не возобновляю")
+                continue
+            JOURNAL.resume(record)
+            run = await restore_job(record)
+            text = f"🔁 Бот перезапустился, задача «{record.title}» возобновлена"
+            if record.resume_at:
+                text += f" с {record.resume_at // 60:.0f}:{record.resume_at % 60:02.0f}"
+            await bot.send_message(record.chat_id, text)
+            await enqueue(record.chat_id, record.title, run, record=record)
+        except Exception as e:
+            JOURNAL.finish(record)
+            print(f"Не удалось возобновить задачу {record.title}: {e}")
+            try:
+                await bot.send_message(record.chat_id, f"⚠️ Не удалось возобновить задачу «{record.title}»: {e}")
+            except Exception:
+                pass
+
+
+def setup():
+    """Открывает все, что трогает диск, сеть и потоки.
+
+    При импорте main.py ничего этого не происходит: процессы пула parallel.py
+    (spawn) заново импортируют этот файл как __mp_main__ и не должны чистить
+    чужие папки задач, открывать сессию телетона и базы.
+    """
+    global RESULTS, JOURNAL, bot
+    WORKSPACES.cleanup()
+    SPILL.cleanup()
+    RESULTS = ResultCache(join(dirname, 'results.sqlite'), CACHE_MAX_MB)
+    JOURNAL = JobJournal(join(dirname, 'journal.sqlite'))
+    init_executor(WORKERS)
+    bot = TelegramClient('whisper_bot', API_ID, API_HASH)
+    bot.add_event_handler(message_router, events.NewMessage)
+    bot.add_event_handler(callback_router, events.CallbackQuery)
+
 
 async def main():
     """Главная функция запуска бота"""
+    setup()
+    metrics_runner = None
+    warm_up_task = None
     try:
+        startup.mark("импорт модулей", process_uptime())
+        # Модель грузится в фоне, параллельно с подключением к Telegram.
+        # Воркеры очереди запустятся, когда она будет готова
+        warm_up_task = asyncio.create_task(start_inference())
+
         # Запускаем бота с токеном
+        started = time.perf_counter()
         await bot.start(bot_token=BOT_TOKEN)
+        startup.mark("подключение к Telegram", time.perf_counter() - started)
         
         # Устанавливаем меню команд при запуске бота
+        started = time.perf_counter()
         await setup_bot_commands()
+        startup.mark("меню команд", time.perf_counter() - started)
+
+        # Задачи, которые не успели доделать до перезапуска, встают в очередь первыми
+        await resume_jobs()
+
+        if METRICS_PORT:
+            metrics_runner = await metrics.serve(METRICS_PORT, METRICS_HOST)
+            print(f"Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
         
         # Проверяем наличие необходимых утилит
         try:
-            subprocess.run(['wget', '--version'], capture_output=True, check=True)
             subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
         except:
-            print("Предупреждение: wget или ffmpeg не установлены. Большие файлы не будут обрабатываться.")
+            print("Предупреждение: ffmpeg не установлен. Аудио не будет обрабатываться.")
         
-        print("Бот запущен...")
+        print(f"Бот запущен, воркеров: {WORKERS}...")
         await bot.run_until_disconnected()
         
     except Exception as e:
         print(f"Бот упал с ошибкой: {e}")
         traceback.print_exc()
     finally:
+        if warm_up_task is not None:
+            warm_up_task.cancel()
+        await scheduler.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await bot.disconnect()
 
 
 if __name__ == '__main__':
-    bot.loop.run_until_complete(main())
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""Метрики бота в формате Prometheus: счетчики, гауги и гистограммы.
+
+Все метрики живут в одном реестре REGISTRY. render() отдает их текстом
+для /metrics, serve() поднимает необязательный HTTP-эндпоинт. Гистограммы
+дополнительно помнят последние наблюдения, чтобы /stats мог показать
+медиану и 95-й перцентиль без Prometheus.
+"""
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Границы бакетов по умолчанию, секунды
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+RECENT = 500  # сколько последних наблюдений держать для перцентилей
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Метрика с набором значений по меткам"""
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, function=None):
+        self.name = name
+        self.help = help_text
+        self.function = function  # значение считается при чтении: () -> число или [(labels, число)]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _samples(self):
+        if self.function is not None:
+            value = self.function()
+            if isinstance(value, list):
+                return [(_labels_key(labels), v) for labels, v in value]
+            return [((), value)]
+        with self._lock:
+            return list(self._values.items())
+
+    def value(self, **labels):
+        for key, value in self._samples():
+            if key == _labels_key(labels):
+                return value
+        return 0
+
+    def total(self):
+        """Сумма по всем меткам"""
+        return sum(value for _, value in self._samples())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Только растет"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_labels_key(labels)] = value
+
+
+class Histogram(Metric):
+    """Распределение наблюдений по бакетам"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {
+                    'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0,
+                    'recent': deque(maxlen=RECENT),
+                }
+            n = bisect.bisect_left(self.buckets, value)
+            if n < len(self.buckets):
+                state['counts'][n] += 1
+            state['sum'] += value
+            state['count'] += 1
+            state['recent'].append(value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время блока with, в том числе внутри корутин"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def summary(self):
+        """{labels: (count, p50, p95)} по последним наблюдениям"""
+        with self._lock:
+            states = {key: (state['count'], sorted(state['recent'])) for key, state in self._values.items()}
+        result = {}
+        for key, (count, recent) in states.items():
+            if recent:
+                result[key] = (count, recent[len(recent) // 2], recent[min(len(recent) - 1, int(len(recent) * 0.95))])
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(key, list(state['counts']), state['sum'], state['count']) for key, state in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик, которые отдаются вместе"""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, function=None):
+        return self.register(Counter(name, help_text, function))
+
+    def gauge(self, name, help_text, function=None):
+        return self.register(Gauge(name, help_text, function))
+
+    def histogram(self, name, help_text, buckets=SECONDS_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram('bot_stage_seconds', 'Длительность этапов обработки')
+JOBS = REGISTRY.counter('bot_jobs_total', 'Завершенные задачи по итогу')
+AUDIO_SECONDS = REGISTRY.counter('bot_audio_seconds_total', 'Сколько секунд аудио распознано')
+REALTIME_FACTOR = REGISTRY.histogram('bot_realtime_factor', 'Время инференса, деленное на длительность аудио',
+                                     buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5))
+MODEL_LOAD_SECONDS = REGISTRY.histogram('bot_model_load_seconds', 'Время загрузки реплики модели')
+FLOOD_WAITS = REGISTRY.counter('bot_flood_waits_total', 'Сколько раз Telegram ответил FloodWait')
+ERRORS = REGISTRY.counter('bot_errors_total', 'Ошибки, о которых сообщили пользователю')
+STARTED = time.time()
+REGISTRY.gauge('bot_uptime_seconds', 'Время работы процесса', lambda: time.time() - STARTED)
+
+
+async def serve(port, host='127.0.0.1'):
+    """Поднимает HTTP-эндпоинт /metrics, возвращает runner для остановки"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,114 @@
+"""Параллельная транскрипция длинных записей по кускам в пуле процессов.
+
+Запись режется на куски по CHUNK_SECONDS, граница каждого сдвигается в
+самый тихий момент рядом, чтобы не резать слова. Куски транскрибируются
+в отдельных процессах, у каждого своя реплика модели, но веса лежат в общей
+памяти (share_memory), поэтому в RAM они одни на весь пул. Аудио тоже
+передается через общую память, без копирования в каждый процесс.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+import torch.multiprocessing as torch_mp
+
+from engine import Progress, Segment, Transcript, detect_language, mel_window, transcribe
+from ingest import SAMPLE_RATE
+
+CHUNK_SECONDS = 300
+SEARCH_SECONDS = 15
+FRAME = SAMPLE_RATE // 50  # окно для оценки громкости, 20 мс
+
+_model = None
+
+
+def split_on_silence(audio, chunk_seconds=CHUNK_SECONDS, search_seconds=SEARCH_SECONDS):
+    """Границы кусков (в сэмплах) примерно по chunk_seconds, сдвинутые в тишину"""
+    frames = len(audio) // FRAME
+    energy = np.empty(frames, dtype=np.float32)
+    # считаем блоками, чтобы не копировать всю запись разом
+    block = 50 * 60 * FRAME
+    for start in range(0, frames * FRAME, block):
+        part = np.asarray(audio[start:min(start + block, frames * FRAME)], dtype=np.float32)
+        energy[start // FRAME: start // FRAME + len(part) // FRAME] = \
+            np.square(part.reshape(-1, FRAME)).mean(axis=1)
+
+    target = chunk_seconds * 50
+    search = search_seconds * 50
+    cuts = [0]
+    # последний кусок может быть до полутора раз длиннее, чтобы не оставлять огрызок
+    while frames - cuts[-1] > target * 3 // 2:
+        lo = cuts[-1] + target - search
+        hi = min(frames, cuts[-1] + target + search)
+        cuts.append(lo + int(np.argmin(energy[lo:hi])))
+    bounds = [cut * FRAME for cut in cuts] + [len(audio)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _init_worker(model, threads):
+    global _model
+    _model = model
+    torch.set_num_threads(threads)
+
+
+def _transcribe_chunk(audio, start, end, language):
+    transcript = transcribe(_model, audio[start:end], language)
+    offset = start / SAMPLE_RATE
+    return [(s.start + offset, s.end + offset, s.text) for s in transcript.segments]
+
+
+class ParallelTranscriber:
+    """Пул процессов с общей репликой модели для длинных записей"""
+
+    def __init__(self, model, workers):
+        self.model = model
+        self.workers = workers
+        self.active = 0  # сколько транскрипций сейчас идет через пул
+        model.share_memory()
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self._pool = ProcessPoolExecutor(
+            workers, mp_context=torch_mp.get_context('spawn'),
+            initializer=_init_worker, initargs=(model, threads),
+        )
+
+    def transcribe_iter(self, audio, language=None):
+        """Как engine.transcribe_iter: отдает Segment и Progress, возвращает Transcript.
+
+        Сегменты отдаются по порядку: кусок выдается, когда готовы все
+        предыдущие, прогресс — по мере готовности любого куска.
+        """
+        total = len(audio) / SAMPLE_RATE
+        if language is None:
+            with torch.inference_mode():
+                language = detect_language(self.model, mel_window(self.model, audio, 0))
+        shared = torch.tensor(np.asarray(audio), dtype=torch.float32).share_memory_()
+        chunks = split_on_silence(audio)
+        futures = {
+            self._pool.submit(_transcribe_chunk, shared, start, end, language): n
+            for n, (start, end) in enumerate(chunks)
+        }
+        ready = {}
+        next_chunk = 0
+        done = 0
+        segments = []
+        try:
+            for future in as_completed(futures):
+                n = futures[future]
+                ready[n] = future.result()
+                start, end = chunks[n]
+                done += end - start
+                while next_chunk in ready:
+                    for start_s, end_s, text in ready.pop(next_chunk):
+                        segment = Segment(start_s, end_s, text)
+                        segments.append(segment)
+                        yield segment
+                    next_chunk += 1
+                yield Progress(done / SAMPLE_RATE, total)
+        finally:
+            for future in futures:
+                future.cancel()
+        return Transcript(segments, language)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
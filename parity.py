@@ -0,0 +1,87 @@
+"""Проверка, что оптимизированные бэкенды распознают не хуже обычного whisper.
+
+Каждый доступный бэкенд распознает те же файлы, текст сравнивается
+с результатом fp32 по WER (доле ошибочных слов). Если расхождение больше
+порога, скрипт завершается с кодом 1. Без файлов распознается
+синтетическая речь из bench.py (espeak-ng, если он установлен), так что
+проверку можно запускать без подготовленных записей.
+
+    python parity.py [запись.mp3 еще.ogg ...] --model small --max-wer 0.1
+"""
+import argparse
+import re
+import sys
+import tempfile
+import time
+
+from backends import available_backends, load_model, model_key, transcribe_iter
+from ingest import SAMPLE_RATE, load_audio
+
+
+def words(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def wer(reference, hypothesis):
+    """Расстояние Левенштейна по словам, деленное на длину эталона"""
+    ref, hyp = words(reference), words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, start=1):
+        current = [i]
+        for j, w in enumerate(hyp, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != w)))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def run(key, model, audio, language):
+    events = transcribe_iter(key, model, audio, language)
+    try:
+        while True:
+            next(events)
+    except StopIteration as e:
+        return e.value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--seconds', type=float, default=30, help="длина синтетической записи без файлов")
+    parser.add_argument('--model', default='tiny')
+    parser.add_argument('--language', default=None)
+    parser.add_argument('--max-wer', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.files:
+        clips = [(path, load_audio(path)) for path in args.files]
+    else:
+        from bench import synth_speech
+        with tempfile.TemporaryDirectory() as workdir:
+            audio, source = synth_speech(args.seconds, workdir)
+        clips = [(f"{source} {args.seconds:.0f} с", audio)]
+    reference = {}
+    failed = False
+    for backend in available_backends():
+        key = model_key(args.model, backend.key)
+        started = time.time()
+        model = load_model(key)
+        print(f"{key}: загрузка {time.time() - started:.1f} с")
+        for path, audio in clips:
+            started = time.time()
+            transcript = run(key, model, audio, args.language)
+            rtf = (time.time() - started) / (len(audio) / SAMPLE_RATE)
+            if backend.key == 'fp32':
+                reference[path] = transcript.text
+                print(f"  {path}: RTF {rtf:.2f}")
+                continue
+            error = wer(reference[path], transcript.text)
+            failed |= error > args.max_wer
+            print(f"  {path}: RTF {rtf:.2f}, WER к fp32 {error:.3f}{' — ПРЕВЫШЕН' if error > args.max_wer else ''}")
+        del model
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
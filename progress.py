@@ -0,0 +1,95 @@
+"""Редкие и склеенные обновления статусного сообщения с прогрессом транскрипции"""
+import asyncio
+
+from telethon.errors import FloodWaitError
+
+# Сколько символов частичного текста показывать в статусе (лимит сообщения 4096)
+PREVIEW_CHARS = 3500
+
+
+class ProgressReporter:
+    """Копит прогресс и раз в interval секунд отправляет одно редактирование.
+
+    update() ничего не отправляет сам, поэтому вызывать его можно на каждом
+    кадре. Фоновая таска отправляет только последнее состояние, пропускает
+    правку, если текст не изменился или процент вырос меньше чем на min_step
+    без нового текста, и выжидает FloodWait, не задерживая транскрипцию.
+    """
+
+    def __init__(self, edit, interval=3.0, min_step=1.0):
+        self._edit = edit  # async def edit(text)
+        self.interval = interval
+        self.min_step = min_step
+        self.percent = 0.0
+        self.status = "Начало транскрипции..."
+        self.parts = []
+        self.edits = 0
+        self.flood_waits = 0
+        self._sent_text = None
+        self._sent_percent = None
+        self._sent_parts = 0
+        self._task = None
+
+    def update(self, percent=None, status=None, text=None):
+        """Запоминает новое состояние: процент, строку статуса, новый кусок текста"""
+        if percent is not None:
+            self.percent = percent
+        if status is not None:
+            self.status = status
+        if text:
+            self.parts.append(text)
+
+    @property
+    def partial_text(self):
+        return "".join(self.parts).strip()
+
+    def render(self):
+        text = self.status
+        partial = self.partial_text
+        if partial:
+            if len(partial) > PREVIEW_CHARS:
+                partial = "…" + partial[-PREVIEW_CHARS:]
+            text = f"{text}\n\n{partial}"
+        return text
+
+    def _should_send(self, text):
+        if text == self._sent_text:
+            return False
+        if self._sent_percent is None or len(self.parts) != self._sent_parts:
+            return True
+        return self.percent - self._sent_percent >= self.min_step
+
+    async def flush(self):
+        """Отправляет текущее состояние, если оно отличается от отправленного"""
+        text = self.render()
+        if not self._should_send(text):
+            return 0
+        percent, parts = self.percent, len(self.parts)
+        try:
+            await self._edit(text)
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            return e.seconds
+        except Exception as e:
+            print(f"Ошибка при обновлении сообщения: {e}")
+            return 0
+        self.edits += 1
+        self._sent_text, self._sent_percent, self._sent_parts = text, percent, parts
+        return 0
+
+    async def _run(self):
+        delay = 0
+        while True:
+            await asyncio.sleep(max(self.interval, delay))
+            delay = await self.flush()
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,180 @@
+"""Реестр загруженных моделей с LRU-вытеснением в рамках бюджета памяти"""
+import gc
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Примерный расход памяти одной реплики модели (МБ), до загрузки точный размер неизвестен
+MODEL_RAM_MB = {
+    'tiny': 400,
+    'base': 600,
+    'small': 1300,
+    'medium': 3200,
+    'large': 6500,
+    'turbo': 3500,
+    'large-v2': 6500,
+    'large-v3': 6500,
+    'large-v3-turbo': 3500,
+}
+
+# Во сколько раз меньше памяти занимает модель на другом бэкенде (ключ "имя:бэкенд")
+BACKEND_RAM_SCALE = {
+    'int8': 0.4,
+    'ct2': 0.4,
+}
+
+
+def estimate_model_mb(key):
+    """Примерный размер реплики по ключу модели вида small или small:int8"""
+    name, _, backend = key.partition(':')
+    return MODEL_RAM_MB.get(name, 1000) * BACKEND_RAM_SCALE.get(backend, 1.0)
+
+
+def default_budget_mb():
+    """Бюджет по умолчанию — 70% всей памяти машины, без psutil бюджета нет"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return int(psutil.virtual_memory().total * 0.7) // (1024 * 1024)
+
+
+def model_size_mb(model):
+    """Сколько памяти занимают веса и буферы модели.
+
+    Считается по state_dict: у квантованных слоев веса лежат не в parameters(),
+    а в упакованном виде. Для моделей не на torch (faster-whisper) — None.
+    """
+    if not hasattr(model, 'state_dict'):
+        return None
+    size = 0
+    for value in model.state_dict().values():
+        for t in value if isinstance(value, tuple) else (value,):
+            if hasattr(t, 'element_size'):
+                size += t.numel() * t.element_size()
+    return size / (1024 * 1024)
+
+
+class ModelEntry:
+    """Все реплики одной модели"""
+
+    def __init__(self, name):
+        self.name = name
+        self.free = []
+        self.busy = 0
+        self.size_mb = None  # размер одной реплики, известен после первой загрузки
+        self.load_time = None
+        self.loads = 0
+
+    @property
+    def replicas(self):
+        return len(self.free) + self.busy
+
+    @property
+    def estimate_mb(self):
+        return self.size_mb or estimate_model_mb(self.name)
+
+
+class ModelRegistry:
+    """Держит недавно использованные модели в памяти.
+
+    Одну реплику нельзя использовать из двух потоков сразу: whisper вешает
+    хуки kv-cache прямо на модули модели. Поэтому каждая транскрипция берет
+    свободную реплику, а если свободных нет — загружает новую. Перед загрузкой
+    освобождается место под бюджет: выгружаются свободные реплики давно не
+    использованных моделей. Если места нет, потому что все занято, ждем,
+    пока кто-нибудь освободит реплику, вместо того чтобы уронить машину по OOM.
+    """
+
+    def __init__(self, loader, budget_mb=None):
+        self._loader = loader
+        self.budget_mb = budget_mb
+        self._entries = OrderedDict()  # от давно использованных к недавним
+        self._cond = threading.Condition()
+
+    def _entry(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            entry = self._entries[name] = ModelEntry(name)
+        self._entries.move_to_end(name)
+        return entry
+
+    def resident_mb(self):
+        return sum(e.replicas * e.estimate_mb for e in self._entries.values())
+
+    def _evict_for(self, need_mb):
+        """Выгружает свободные реплики по LRU, пока новая не влезет в бюджет"""
+        if self.budget_mb is None:
+            return True
+        for entry in list(self._entries.values()):
+            while entry.free and self.resident_mb() + need_mb > self.budget_mb:
+                entry.free.pop()
+                print(f"Выгружена реплика модели {entry.name}")
+        gc.collect()
+        return self.resident_mb() + need_mb <= self.budget_mb
+
+    def acquire(self, name):
+        """Берет свободную реплику модели, при необходимости загружая новую"""
+        with self._cond:
+            while True:
+                entry = self._entry(name)
+                if entry.free:
+                    entry.busy += 1
+                    return entry.free.pop()
+                if self.budget_mb is not None and entry.estimate_mb > self.budget_mb:
+                    raise MemoryError(f"Модель {name} (~{entry.estimate_mb:.0f} МБ) "
+                                      f"не помещается в бюджет {self.budget_mb} МБ")
+                if self._evict_for(entry.estimate_mb):
+                    # место резервируем сразу, чтобы параллельная загрузка его не заняла
+                    entry.busy += 1
+                    break
+                self._cond.wait()
+        try:
+            started = time.time()
+            model = self._loader(name)
+        except BaseException:
+            with self._cond:
+                entry.busy -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            entry.load_time = time.time() - started
+            entry.size_mb = model_size_mb(model)
+            entry.loads += 1
+            print(f"Модель {name} загружена за {entry.load_time:.1f} с, {entry.estimate_mb:.0f} МБ")
+        return model
+
+    def release(self, name, model):
+        with self._cond:
+            entry = self._entry(name)
+            entry.busy -= 1
+            entry.free.append(model)
+            self._cond.notify_all()
+
+    @contextmanager
+    def use(self, name):
+        model = self.acquire(name)
+        try:
+            yield model
+        finally:
+            self.release(name, model)
+
+    def preload(self, name):
+        """Загружает модель, если ее нет в памяти. Возвращает время загрузки или None"""
+        with self._cond:
+            entry = self._entries.get(name)
+            if entry is not None and entry.replicas:
+                self._entry(name)
+                return None
+        self.release(name, self.acquire(name))
+        return self._entries[name].load_time
+
+    def stats(self):
+        """Сведения о моделях в памяти, от недавно использованных к давним"""
+        with self._cond:
+            return [
+                {'name': e.name, 'replicas': e.replicas, 'busy': e.busy,
+                 'size_mb': e.size_mb, 'load_time': e.load_time}
+                for e in reversed(self._entries.values()) if e.replicas
+            ]
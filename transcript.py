@@ -0,0 +1,36 @@
+"""Результаты транскрипции: сегменты, прогресс и итог.
+
+Отдельно от engine, чтобы их можно было импортировать без torch и whisper.
+"""
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Segment:
+    """Распознанный отрезок с таймстемпами в секундах"""
+    start: float
+    end: float
+    text: str
+    tokens: list = field(default_factory=list, repr=False)
+
+
+@dataclass
+class Progress:
+    """Сколько секунд аудио уже обработано из общего числа"""
+    done: float
+    total: float
+
+    @property
+    def percent(self):
+        return self.done / self.total * 100 if self.total else 0.0
+
+
+@dataclass
+class Transcript:
+    """Итог транскрипции"""
+    segments: list
+    language: str
+
+    @property
+    def text(self):
+        return "".join(segment.text for segment in self.segments)
@@ -0,0 +1,138 @@
+"""Поиск речи по энергии сигнала, чтобы не гонять модель по тишине и музыке.
+
+Из PCM вырезаются только участки с речью и склеиваются в одну запись,
+которую и распознает модель. Таймлайн помнит, откуда взят каждый участок,
+и переводит таймстемпы сегментов обратно во время исходной записи.
+"""
+import bisect
+
+import numpy as np
+
+from ingest import SAMPLE_RATE
+from transcript import Segment, Transcript
+
+FRAME = SAMPLE_RATE * 30 // 1000  # 30 мс
+MARGIN_DB = 12.0  # насколько громче фонового шума должна быть речь
+MIN_LEVEL_DB = -55.0  # тише этого речи точно нет
+PAD_SECONDS = 0.3  # запас вокруг речи, чтобы не съедать начала и концы слов
+MIN_GAP_SECONDS = 0.8  # паузы короче склеиваются
+MIN_SPEECH_SECONDS = 0.25  # более короткие участки речи считаются шумом
+LOUD_PERCENTILE = 99  # громкие кадры, по которым видно, есть ли в записи что-то кроме фона
+
+
+def frame_levels(audio):
+    """Громкость каждого 30-мс кадра в дБ относительно полной шкалы"""
+    frames = len(audio) // FRAME
+    levels = np.empty(frames, dtype=np.float32)
+    block = 2000 * FRAME
+    for start in range(0, frames * FRAME, block):
+        part = np.asarray(audio[start:min(start + block, frames * FRAME)], dtype=np.float32)
+        power = np.square(part.reshape(-1, FRAME)).mean(axis=1)
+        levels[start // FRAME: start // FRAME + len(power)] = 10 * np.log10(power + 1e-10)
+    return levels
+
+
+def speech_regions(audio):
+    """Участки речи [(start, end), ...] в сэмплах; пустой список, если речь
+    не удалось отделить от фона"""
+    levels = frame_levels(audio)
+    if not len(levels):
+        return []
+    noise_floor, median, loud = np.percentile(levels, [10, 50, LOUD_PERCENTILE])
+    if median - noise_floor < MARGIN_DB and loud - median < MARGIN_DB:
+        # громкость ровная по всей записи: фон и есть речь (или шум без речи),
+        # и порог от уровня фона ничего осмысленного не отделит
+        return []
+    is_speech = levels > max(noise_floor + MARGIN_DB, MIN_LEVEL_DB)
+
+    frames_per_second = SAMPLE_RATE / FRAME
+    bursts = []
+    start = None
+    for n, speech in enumerate(np.append(is_speech, False)):
+        if speech and start is None:
+            start = n
+        elif not speech and start is not None:
+            bursts.append([start, n])
+            start = None
+
+    # Сначала склеиваем всплески через короткие паузы: в слитной речи каждый
+    # слог по отдельности короче MIN_SPEECH_SECONDS. Отсеиваем уже участки
+    pad = int(PAD_SECONDS * frames_per_second)
+    min_gap = int(MIN_GAP_SECONDS * frames_per_second) + 2 * pad
+    merged = []
+    for start, end in bursts:
+        if merged and start - merged[-1][1] <= min_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    min_speech = MIN_SPEECH_SECONDS * frames_per_second
+    return [(max(0, start - pad) * FRAME, min(len(audio), min(len(levels), end + pad) * FRAME))
+            for start, end in merged if end - start >= min_speech]
+
+
+class SpeechTimeline:
+    """Соответствие между склеенной речью и временем исходной записи"""
+
+    def __init__(self, regions, total_samples):
+        self.regions = regions
+        self.total = total_samples / SAMPLE_RATE
+        self._compact_starts = []
+        position = 0
+        for start, end in regions:
+            self._compact_starts.append(position / SAMPLE_RATE)
+            position += end - start
+        self.speech = position / SAMPLE_RATE
+
+    @property
+    def skipped(self):
+        """Сколько секунд тишины выкинуто"""
+        return self.total - self.speech
+
+    def to_original(self, t, is_end=False):
+        """Переводит время в склеенной записи во время исходной"""
+        if not self.regions:
+            return t
+        # граница двух участков: начало сегмента относим к следующему, конец — к предыдущему
+        if is_end:
+            n = bisect.bisect_left(self._compact_starts, t) - 1
+        else:
+            n = bisect.bisect_right(self._compact_starts, t) - 1
+        n = max(0, n)
+        start, end = self.regions[n]
+        return min(start / SAMPLE_RATE + t - self._compact_starts[n], end / SAMPLE_RATE)
+
+    def remap(self, segment):
+        return Segment(self.to_original(segment.start), self.to_original(segment.end, is_end=True),
+                       segment.text, segment.tokens)
+
+
+def apply_vad(audio):
+    """Склеивает только речь. Возвращает новый PCM и таймлайн.
+
+    Если участков речи не нашлось, порог не подошел к записи (например,
+    речь без пауз, где фон и есть речь), и модель получает запись целиком.
+    Короткая речь в длинной тишине — как раз случай для VAD, ее не трогаем.
+    """
+    regions = speech_regions(audio)
+    if not regions:
+        return audio, SpeechTimeline([(0, len(audio))], len(audio))
+    timeline = SpeechTimeline(regions, len(audio))
+    compact = np.concatenate([np.asarray(audio[start:end], dtype=np.float32) for start, end in regions])
+    return compact, timeline
+
+
+def remap_events(events, timeline):
+    """Оборачивает генератор транскрипции склеенной речи, возвращая таймстемпы
+    к исходной записи"""
+    try:
+        while True:
+            try:
+                event = next(events)
+            except StopIteration as e:
+                transcript = e.value
+                return Transcript([timeline.remap(s) for s in transcript.segments], transcript.language)
+            if isinstance(event, Segment):
+                event = timeline.remap(event)
+            yield event
+    finally:
+        events.close()
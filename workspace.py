@@ -0,0 +1,112 @@
+"""Отдельная временная папка на каждую задачу.
+
+Папки создаются в tmpfs (/dev/shm), если он есть, так что промежуточные
+файлы живут в памяти, а не на диске. Имена файлов внутри папки можно брать
+любые — параллельные задачи друг другу не мешают. Папка удаляется целиком
+при выходе из задачи, что бы в ней ни осталось. Суммарный размер всех папок
+ограничен квотой. Файлы резервируют место заранее, до записи, так что две
+задачи не могут одновременно пройти проверку и вместе превысить квоту.
+"""
+import os
+import shutil
+import tempfile
+
+PREFIX = 'telebot-audioparser-'
+
+
+def default_root():
+    """tmpfs, если он есть и доступен на запись, иначе системная временная папка"""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def disk_root():
+    """Временная папка на диске, а не в памяти: /var/tmp, если он есть"""
+    if os.path.isdir('/var/tmp') and os.access('/var/tmp', os.W_OK):
+        return '/var/tmp'
+    return tempfile.gettempdir()
+
+
+class QuotaExceeded(Exception):
+    """Во временных папках не хватает места"""
+
+
+def _tree_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return size
+
+
+class Workspaces:
+    """Создает папки задач и следит за квотой"""
+
+    def __init__(self, root=None, quota_mb=1024):
+        self.root = root or default_root()
+        self.quota_bytes = quota_mb * 1024 * 1024
+        self._active = set()
+        self._reserved = {}  # папка -> сколько байт в ней зарезервировано
+
+    def cleanup(self):
+        """Удаляет папки, оставшиеся от прошлого запуска"""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(PREFIX) and path not in self._active:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def used_bytes(self):
+        """Занято папками: записанное или зарезервированное, что больше.
+        Резерв покрывает и уже записанную часть файла, поэтому не складываем"""
+        return sum(max(_tree_size(path), self._reserved.get(path, 0)) for path in self._active)
+
+    def available_bytes(self):
+        """Сколько еще можно записать: меньшее из остатка квоты и свободного места"""
+        free = shutil.disk_usage(self.root).free
+        return max(0, min(self.quota_bytes - self.used_bytes(), free))
+
+    def create(self, job_id):
+        path = tempfile.mkdtemp(prefix=f"{PREFIX}{job_id}-", dir=self.root)
+        self._active.add(path)
+        return Workspace(self, path)
+
+    def reserve(self, path, nbytes):
+        """Резервирует nbytes в папке задачи path или бросает QuotaExceeded"""
+        available = self.available_bytes()
+        if nbytes > available:
+            raise QuotaExceeded(f"Не хватает места для временных файлов: нужно "
+                                f"{nbytes // (1024 * 1024)} МБ, свободно {available // (1024 * 1024)} МБ")
+        self._reserved[path] = max(self._reserved.get(path, 0), _tree_size(path)) + nbytes
+
+    def _release(self, path):
+        self._active.discard(path)
+        self._reserved.pop(path, None)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class Workspace:
+    """Папка одной задачи, удаляется при выходе из with"""
+
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.dir = path
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def reserve(self, nbytes):
+        """Резервирует место под файл размером nbytes, до закрытия папки"""
+        self.manager.reserve(self.dir, nbytes)
+
+    def close(self):
+        self.manager._release(self.dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()